@@ -1,3 +1,9 @@
 #!/bin/bash
-pyinstaller --onefile --add-data "static:static" --add-data "templates:templates" --add-data "pkg:pkg" wsgi.py --name \
-nodeAgent --distpath ./deploy
\ No newline at end of file
+# 预压缩静态资源并生成带内容哈希的 manifest
+python static_assets.py static
+# 预编译 jinja 模板字节码
+python template_cache.py template_cache
+pyinstaller --onefile --add-data "static:static" --add-data "templates:templates" --add-data "pkg:pkg" \
+--add-data "template_cache:template_cache" \
+--add-data "gunicorn.conf.py:." --hidden-import gunicorn.glogging --hidden-import gunicorn.workers.ggevent \
+wsgi.py --name nodeAgent --distpath ./deploy
@@ -0,0 +1,109 @@
+"""
+调用边缘服务端的熔断器。
+
+- closed: 正常放行，连续失败达到 failure_threshold 次后进入 open
+- open: 直接拒绝调用，不再等待网络超时；经过 reset_timeout 秒后进入 half_open
+- half_open: 只放行 half_open_max_calls 个探测请求，探测成功回到 closed，失败重新进入 open
+
+只有连接异常、超时和 5xx 算作失败，4xx 或业务错误码说明服务端是可达的。
+"""
+import threading
+import time
+
+from log_tool import Logger
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class Rejected(str):
+    """
+    被熔断器拒绝的调用返回的错误信息，本身就是字符串，可以直接展示给用户；
+    调用方(例如 outbox)据此区分"根本没有发出请求"和真正的请求失败，retry_in 为距离下一次探测的秒数。
+    """
+
+    def __new__(cls, reason, retry_in):
+        obj = super().__new__(cls, reason)
+        obj.retry_in = retry_in
+        return obj
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold, reset_timeout, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+        # 累计计数，通过 snapshot() 暴露
+        self.stats = {'success': 0, 'failure': 0, 'rejected': 0, 'opened': 0}
+
+    def allow(self):
+        """返回 (是否放行, 拒绝原因 Rejected)"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.stats['rejected'] += 1
+                    return False, Rejected(self._reject_reason(), self.retry_in())
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self.stats['rejected'] += 1
+                    # 探测请求的结果还没有返回，稍后再试
+                    return False, Rejected(self._reject_reason(), 1.0)
+                self._probes += 1
+            return True, None
+
+    def record_success(self):
+        with self._lock:
+            self.stats['success'] += 1
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failure'] += 1
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+
+    def retry_in(self):
+        """open 状态下距离下一次探测的秒数"""
+        if self.state != OPEN:
+            return 0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def snapshot(self):
+        with self._lock:
+            data = {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'retry_in': round(self.retry_in(), 3),
+            }
+            data.update(self.stats)
+            return data
+
+    def _reject_reason(self):
+        if self.state == OPEN:
+            return f'{self.name} 不可用(熔断中)，{int(self.retry_in()) + 1} 秒后重试'
+        return f'{self.name} 不可用(熔断中)，正在探测恢复'
+
+    def _transition(self, state):
+        Logger.info(f'Circuit breaker {self.name}: {self.state} -> {state} (consecutive failures {self.failures})')
+        self.state = state
+        self._probes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.stats['opened'] += 1
+        elif state == CLOSED:
+            self.opened_at = None
@@ -0,0 +1,73 @@
+"""
+gevent 协作式调度相关的辅助函数。
+
+wsgi.py 启动时已经 monkey patch，subprocess / socket / time.sleep 都会让出事件循环；
+但 C 扩展内部的阻塞系统调用(例如 psutil.disk_usage 的 statvfs)依然会卡住整个进程，需要放到原生线程池中执行。
+"""
+import threading
+
+from gevent import Timeout, get_hub, monkey
+from gevent.threadpool import ThreadPool
+
+from config import Config
+
+_native_pool = None
+
+
+def is_cooperative():
+    """当前进程是否运行在 gevent patch 之后的协程环境中"""
+    return monkey.is_module_patched('threading')
+
+
+def offload(func, *args, **kwargs):
+    """在原生线程中执行阻塞调用，调用方协程等待结果期间事件循环可以继续处理其他请求；未 patch 时直接调用"""
+    if not is_cooperative():
+        return func(*args, **kwargs)
+    return get_hub().threadpool.apply(func, args, kwargs)
+
+
+class NativeCall:
+    """
+    在原生线程中执行的一次阻塞调用，可以带超时等待结果。
+    超时只是放弃等待，调用本身无法中断，线程会一直占用到系统调用返回为止。
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        if is_cooperative():
+            # hub 自带的线程池很小，卡死的调用会把它占满，这里使用独立的线程池
+            global _native_pool
+            if _native_pool is None:
+                _native_pool = ThreadPool(Config.native_pool_size)
+            self._async_result = _native_pool.spawn(func, *args, **kwargs)
+        else:
+            self._async_result = None
+            self._done = threading.Event()
+            self._value = None
+            self._exception = None
+            threading.Thread(target=self._run, args=(func, args, kwargs), daemon=True).start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._value = func(*args, **kwargs)
+        except BaseException as e:
+            self._exception = e
+        finally:
+            self._done.set()
+
+    def ready(self):
+        if self._async_result is not None:
+            return self._async_result.ready()
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """等待结果，超时抛出 TimeoutError，调用本身的异常原样抛出"""
+        if self._async_result is not None:
+            try:
+                return self._async_result.get(timeout=timeout)
+            except Timeout:
+                raise TimeoutError()
+        if not self._done.wait(timeout):
+            raise TimeoutError()
+        if self._exception is not None:
+            raise self._exception
+        return self._value
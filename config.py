@@ -9,7 +9,94 @@ class Config:
 
     edge_server_host = 'http://10.10.0.234:6006'
     timeout = 5
+    # 边缘服务端熔断: 连续失败次数阈值、熔断后等待探测的秒数、半开状态放行的探测请求数
+    edge_breaker_failure_threshold = 5
+    edge_breaker_reset_timeout = 30
+    edge_breaker_half_open_calls = 1
     success_code = '0000'
     fail_code = '0001'
 
     device_register_url = '/genbu/edge/device/register'
+    # 边缘服务端响应的本地缓存目录(相对工作目录)
+    response_cache_dir = 'cache'
+
+    # tools.run_command: 默认超时(秒)、超时后等待进程组退出的时间、每路输出保留的尾部字符数及单行最大长度
+    command_timeout = 600
+    command_kill_grace = 5
+    command_output_tail = 256 * 1024
+    command_max_line = 64 * 1024
+    # gevent 下管道中有缓冲数据时 readline 不会让出事件循环，每读取这么多行主动让出一次
+    command_yield_lines = 100
+    helm_timeout = 1800
+
+    # 每个 API Server 的连接池大小，缓存的客户端数量上限及空闲淘汰时间(秒)
+    k8s_connection_pool_maxsize = 32
+    k8s_client_registry_size = 8
+    k8s_client_idle_timeout = 600
+
+    # 磁盘统计: 单个挂载点 statvfs 的超时(秒)、无响应挂载点的隔离时间(秒，连续超时翻倍，最多 8 倍)、结果缓存时间(秒)
+    disk_stat_timeout = 2
+    disk_stat_quarantine = 300
+    disk_stat_cache_ttl = 10
+    # 设备信息中不展示的网卡名前缀
+    network_interface_exclude_prefixes = ('lo', 'docker', 'veth', 'flannel', 'cni')
+
+    # CPU / 内存指标采集后端: psutil 或 proc(直接读取 /proc，见 proc_metrics.py)
+    metrics_backend = 'psutil'
+    # CpuSampler 第一次调用时的采样区间(秒)
+    cpu_sample_interval = 0.1
+    # 执行可能卡死的系统调用的原生线程池大小
+    native_pool_size = 16
+
+    # 遥测上报: 采样间隔(秒)、最小/最大批大小(样本数)、判定链路慢的上报耗时(秒)、离线时最多保留的批次数、每次补发的批次数
+    # 默认关闭，边缘服务端提供遥测接口后通过 Config 或环境变量 telemetryEnabled=1 开启
+    telemetry_enabled = False
+    telemetry_url = '/genbu/edge/device/telemetry'
+    telemetry_interval = 10
+    telemetry_batch_size = 6
+    telemetry_max_batch_size = 60
+    telemetry_slow_rtt = 1.0
+    telemetry_spool_dir = 'cache/telemetry'
+    telemetry_spool_max_files = 1440
+    telemetry_drain_batches = 10
+
+    # 边缘服务端请求 outbox: 轮询间隔(秒)、达到后记录告警的尝试次数、重试退避的初始值与上限(秒)、
+    # 单次投递的租约(秒)、投递进程的文件锁
+    outbox_poll_interval = 2
+    outbox_max_attempts = 20
+    outbox_retry_base = 2
+    outbox_retry_max = 300
+    outbox_lease = 60
+    outbox_lock_file = 'cache/outbox.lock'
+
+    # 开发环境下模板字节码缓存目录(打包后使用构建时生成的 template_cache)，片段缓存的最大条目数
+    template_cache_dir = 'cache/templates'
+    fragment_cache_size = 256
+
+    # 按需剖析: CPU 采样的最长时长和默认采样间隔(秒)，tracemalloc 默认记录的栈深度和最长开启时间(秒)
+    profile_max_seconds = 60
+    profile_interval = 0.01
+    tracemalloc_frames = 5
+    tracemalloc_max_seconds = 600
+
+    # 设备初始化的跨进程文件锁
+    init_lock_file = 'cache/init_device.lock'
+    # 设备初始化最后等待工作负载滚动更新完成的总时间(秒)
+    init_rollout_timeout = 600
+
+    # /api/device_info 采集结果的共享时间(秒)
+    device_info_cache_ttl = 2
+    # /api/device_info 供监控系统轮询，除登录 session 外还接受 Basic 认证(username / password)
+    # 或 Authorization: Bearer <token>；token 为空时不启用，环境变量 deviceInfoToken 优先
+    device_info_token = ''
+
+    # 同时打开的 pod 日志流上限
+    pod_log_max_streams = 8
+
+    # 初始化进度流每个订阅者最多积压的事件数，超过后丢弃命令输出
+    progress_max_pending = 1000
+
+    # CRD discovery 磁盘缓存目录及有效期(秒)，自定义资源 list 的分页大小
+    discovery_cache_dir = 'cache/discovery'
+    discovery_cache_ttl = 6 * 3600
+    custom_resource_page_size = 500
@@ -0,0 +1,84 @@
+import sqlite3
+from threading import local
+
+thread_local = local()
+
+
+def get_db_connection():
+    if not hasattr(thread_local, 'connection'):
+        # 多个 gunicorn worker 共享同一个库文件: WAL 允许读写并发，timeout 让写锁冲突时等待而不是直接报错
+        thread_local.connection = sqlite3.connect('example.db', timeout=10)
+        thread_local.connection.execute('PRAGMA journal_mode=WAL')
+        # 创建表
+        cursor = thread_local.connection.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_name TEXT NOT NULL,
+                device_no TEXT,
+                registered_status INTEGER,
+                initialized_status INTEGER,
+                registered_time TEXT,
+                device_desc TEXT,
+                auth TEXT
+            )
+        ''')
+        # 最近一次成功部署的 Helm release: chart 包摘要 + values 哈希 + helm 记录的 revision
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS helm_release (
+                namespace TEXT NOT NULL,
+                release_name TEXT NOT NULL,
+                chart_digest TEXT,
+                values_hash TEXT,
+                revision INTEGER,
+                deployed_time TEXT,
+                PRIMARY KEY (namespace, release_name)
+            )
+        ''')
+        # kubectl apply 账本: 每组 manifests 的整体哈希以及其中每个对象的归一化哈希
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applied_manifest (
+                ledger_key TEXT PRIMARY KEY,
+                set_hash TEXT,
+                applied_time TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applied_object (
+                ledger_key TEXT NOT NULL,
+                object_key TEXT NOT NULL,
+                object_hash TEXT,
+                PRIMARY KEY (ledger_key, object_key)
+            )
+        ''')
+        # 待发送给边缘服务端的状态变更请求，按 id 顺序逐个设备投递，dedup_key 只在未投递的记录中唯一
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_no TEXT NOT NULL,
+                method TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                payload TEXT,
+                dedup_key TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_time TEXT,
+                delivered_time TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS outbox_pending_dedup ON outbox (dedup_key) WHERE status = 'pending'
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, device_no, id)
+        ''')
+        thread_local.connection.commit()
+    return thread_local.connection
+
+
+def close_db_connection():
+    if hasattr(thread_local, 'connection'):
+        thread_local.connection.close()
+        del thread_local.connection
@@ -1,4 +1,24 @@
-bind = "0.0.0.0:8000"
-workers = 1
-worker_class = "sync"
-timeout = 5
\ No newline at end of file
+import os
+
+# 生产环境统一入口: python wsgi.py <port>，或 gunicorn -c gunicorn.conf.py wsgi:app
+bind = "0.0.0.0:" + os.environ.get('agentPort', '5000')
+
+# gevent 协程 worker，wsgi.py 在导入应用之前完成 monkey patch
+worker_class = "gevent"
+workers = int(os.environ.get('agentWorkers', 1))
+worker_connections = int(os.environ.get('agentWorkerConnections', 1000))
+
+# master 中预加载应用，worker fork 后共享代码和只读数据
+preload_app = True
+
+# gevent worker 的心跳由事件循环发出，init_device 这类长请求只要不阻塞事件循环就不会被判定超时
+timeout = int(os.environ.get('agentWorkerTimeout', 60))
+# SIGTERM / SIGHUP 时给正在处理的请求留出的收尾时间
+graceful_timeout = int(os.environ.get('agentGracefulTimeout', 30))
+keepalive = 5
+
+
+def post_fork(server, worker):
+    from main import start_background_tasks
+
+    start_background_tasks()
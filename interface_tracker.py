@@ -0,0 +1,225 @@
+"""
+基于 rtnetlink 事件的网卡信息跟踪。
+
+启动时完整枚举一次网卡，之后订阅内核的 link / address 变更事件，只重新读取发生变化的那个网卡，
+读取接口信息变成一次字典拷贝；k3s 节点上成百上千的 veth 不再在每次请求时被枚举。
+被排除的网卡前缀由 Config.network_interface_exclude_prefixes 配置。
+非 Linux 或者 netlink 不可用时退化为每次调用都完整枚举。
+"""
+import errno
+import socket
+import struct
+import threading
+
+import netifaces
+
+from config import Config
+from log_tool import Logger
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+NLMSG_OVERRUN = 4
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+
+IFLA_IFNAME = 3
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFINFO_MSG = struct.Struct('=BxHiII')
+IFADDR_MSG = struct.Struct('=BBBBI')
+RTATTR_HEADER = struct.Struct('=HH')
+
+
+def is_excluded(name, exclude_prefixes=None):
+    if exclude_prefixes is None:
+        exclude_prefixes = Config.network_interface_exclude_prefixes
+    return name.startswith(tuple(exclude_prefixes))
+
+
+def get_interface_details(name):
+    """读取单个网卡的 IPv4 / IPv6 地址信息"""
+    addrs = netifaces.ifaddresses(name)
+    details = {}
+    if netifaces.AF_INET in addrs:  # IPv4
+        details['ipv4'] = [
+            {'addr': addr['addr'], 'netmask': addr.get('netmask'), 'broadcast': addr.get('broadcast')}
+            for addr in addrs[netifaces.AF_INET]
+        ]
+    if netifaces.AF_INET6 in addrs:  # IPv6
+        details['ipv6'] = [
+            {'addr': addr['addr'], 'netmask': addr.get('netmask')}
+            for addr in addrs[netifaces.AF_INET6]
+        ]
+    return details
+
+
+def scan_interfaces(exclude_prefixes=None):
+    """完整枚举所有网卡"""
+    interfaces = {}
+    for interface in netifaces.interfaces():
+        if is_excluded(interface, exclude_prefixes):
+            continue
+        try:
+            interfaces[interface] = get_interface_details(interface)
+        except Exception as e:
+            Logger.error(f"Error processing interface {interface}: {e}")
+            continue
+    return interfaces
+
+
+def _copy_interfaces(interfaces):
+    """按 {网卡名: {'ipv4' / 'ipv6': [地址字典]}} 的结构逐层拷贝，调用方修改返回值不会影响跟踪的状态"""
+    return {name: {family: [dict(addr) for addr in addrs] for family, addrs in details.items()}
+            for name, details in interfaces.items()}
+
+
+def _iter_attributes(data, offset, end):
+    while offset + RTATTR_HEADER.size <= end:
+        length, attr_type = RTATTR_HEADER.unpack_from(data, offset)
+        if length < RTATTR_HEADER.size:
+            return
+        yield attr_type, data[offset + RTATTR_HEADER.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+class InterfaceTracker:
+
+    def __init__(self, exclude_prefixes=None):
+        self.exclude_prefixes = tuple(exclude_prefixes or Config.network_interface_exclude_prefixes)
+        self._interfaces = {}
+        # ifindex -> 网卡名，地址事件只带 ifindex
+        self._names = {}
+        self._sock = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """订阅 netlink 事件并完整同步一次，失败时返回 False，调用方退化为完整枚举"""
+        with self._lock:
+            if self._started:
+                return self._sock is not None
+            self._started = True
+            sock = None
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+                sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            except (AttributeError, OSError) as e:
+                if sock is not None:
+                    sock.close()
+                Logger.info(f'rtnetlink unavailable, falling back to full interface scans: {e}')
+                return False
+            self._sock = sock
+        # 先订阅再做全量同步，同步期间发生的变化会在之后的事件中补上
+        try:
+            self._resync()
+        except Exception as e:
+            Logger.error(f'Failed to sync interfaces, falling back to full interface scans: {e}')
+            self._close()
+            return False
+        threading.Thread(target=self._run, name='interface_tracker', daemon=True).start()
+        return True
+
+    def get_interfaces(self):
+        if not self.start():
+            return scan_interfaces(self.exclude_prefixes)
+        with self._lock:
+            return _copy_interfaces(self._interfaces)
+
+    def _close(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+            self._started = False
+        if sock is not None:
+            sock.close()
+
+    def _resync(self):
+        names = {index: name for index, name in socket.if_nameindex()}
+        interfaces = scan_interfaces(self.exclude_prefixes)
+        with self._lock:
+            self._names = names
+            self._interfaces = interfaces
+
+    def _refresh(self, name):
+        if is_excluded(name, self.exclude_prefixes):
+            return
+        try:
+            details = get_interface_details(name)
+        except ValueError:
+            # 网卡已经不存在
+            details = None
+        with self._lock:
+            if details is None:
+                self._interfaces.pop(name, None)
+            else:
+                self._interfaces[name] = details
+
+    def _run(self):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # 事件太多导致接收缓冲区溢出，丢失了部分事件，重新全量同步
+                    Logger.info('rtnetlink receive buffer overflow, resyncing interfaces')
+                    self._resync()
+                    continue
+                Logger.error(f'rtnetlink socket failed, falling back to full interface scans: {e}')
+                self._close()
+                return
+            try:
+                self._handle(data)
+            except Exception as e:
+                Logger.error(f'Failed to handle rtnetlink message: {e}')
+                self._resync()
+
+    def _handle(self, data):
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if length < NLMSG_HEADER.size:
+                return
+            body = offset + NLMSG_HEADER.size
+            end = offset + length
+            if msg_type == NLMSG_OVERRUN:
+                self._resync()
+            elif msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                _, _, index, _, _ = IFINFO_MSG.unpack_from(data, body)
+                name = None
+                for attr_type, value in _iter_attributes(data, body + IFINFO_MSG.size, end):
+                    if attr_type == IFLA_IFNAME:
+                        name = value.rstrip(b'\0').decode()
+                self._on_link(msg_type, index, name)
+            elif msg_type in (RTM_NEWADDR, RTM_DELADDR):
+                index = IFADDR_MSG.unpack_from(data, body)[4]
+                name = self._names.get(index)
+                if name is None:
+                    try:
+                        name = socket.if_indextoname(index)
+                    except OSError:
+                        name = None
+                if name:
+                    self._refresh(name)
+            offset += (length + 3) & ~3
+
+    def _on_link(self, msg_type, index, name):
+        with self._lock:
+            old_name = self._names.get(index)
+            if msg_type == RTM_DELLINK:
+                self._names.pop(index, None)
+                self._interfaces.pop(old_name, None)
+                self._interfaces.pop(name, None)
+                return
+            if name:
+                self._names[index] = name
+            # 网卡改名时去掉旧名字
+            if old_name and old_name != name:
+                self._interfaces.pop(old_name, None)
+        if name:
+            self._refresh(name)
+
+
+interface_tracker = InterfaceTracker()
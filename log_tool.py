@@ -3,11 +3,16 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from gevent import monkey
 from loguru import logger
 import sys
 
+# gevent patch 之后 loguru 的 enqueue 后台线程会变成协程，并在 multiprocessing 管道上阻塞整个事件循环，
+# 因此 gevent 下改为同步写入(handler 内部的锁已被 patch 为协程锁)
+enqueue = not monkey.is_module_patched('threading')
+
 log_file = Path(os.getcwd()) / "logs" / f"agent_{datetime.now().strftime('%Y-%m-%d')}.log"
-logger.add(log_file, enqueue=True, rotation="1 day", retention="7 days")
+logger.add(log_file, enqueue=enqueue, rotation="1 day", retention="7 days")
 
 
 # 自定义序列化函数
@@ -32,7 +37,7 @@ logger.remove(0)
 # 应用 patching
 logger = logger.patch(patching)
 # 配置标准输出 (sys.stderr) 为 JSON 格式
-logger.add(sys.stderr, format="{extra[serialized]}", enqueue=True)
+logger.add(sys.stderr, format="{extra[serialized]}", enqueue=enqueue)
 
 
 class Logger:
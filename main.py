@@ -1,50 +1,56 @@
-import sqlite3
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
 import traceback
+from contextlib import ExitStack
 
+import yaml
 from flask import session, jsonify
-from flask import Flask, render_template, request, redirect, url_for, make_response
+from flask import Flask, Response, render_template, request, redirect, url_for, make_response
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import CSRFError
 
 from config import Config
-from k8s_tool import KubernetesClient
+from db import get_db_connection, close_db_connection
+from k8s_tool import client_registry
 from log_tool import Logger
-from proxy import http_client
+from outbox import enqueue, get_pending_count, get_stuck_count, outbox_dispatcher
+from profiler import profile_cpu, tracemalloc_session
+from progress import ProgressRunner
+from proxy import http_client, telemetry_client
+from singleflight import SingleFlight
+from static_assets import StaticAssetMiddleware
+from template_cache import FragmentCache, TemplateBytecodeCache
+from telemetry import TelemetryPusher
 from tools import init_k3s, apply_kubernetes_yaml, get_cluster_info, get_k8s_token, get_k8s_svc, create_configmap_tz, \
-    install_helm, install_prometheus, install_telegraf, get_resource_path, cp_k3s_config
+    install_helm, install_prometheus, install_telegraf, get_resource_path, cp_k3s_config, subscribe_output, \
+    unsubscribe_output
 from utils import get_os_info, get_hostname, get_network_interfaces_details, get_cpu_info, get_memory_info, \
-    get_disk_info, get_cpu_mem_disk, get_machine_id
-from threading import local
+    get_disk_info, get_cpu_mem_disk, get_machine_id, get_device_info, stable_device_info, DEVICE_INFO_FIELDS
 
-thread_local = local()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = "iECgbYWReMNxkRprrzMo5KAQYnb2UeZ3bwvReTSt+VSESW0OB8zbglT+6rEcDW9X"
 
-CSRFProtect(app)
+csrf = CSRFProtect(app)
 app.config['WTF_CSRF_HEADERS'] = ['X-CSRFToken']
 
-k8s_client = KubernetesClient(Config.k8s_host, Config.k8s_token)
-
-
-def get_db_connection():
-    if not hasattr(thread_local, 'connection'):
-        thread_local.connection = sqlite3.connect('example.db')
-        # 创建表
-        cursor = thread_local.connection.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS device (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_name TEXT NOT NULL,
-                device_no TEXT,
-                registered_status INTEGER,
-                initialized_status INTEGER,
-                registered_time TEXT,
-                device_desc TEXT,
-                auth TEXT
-            )
-        ''')
-        thread_local.connection.commit()
-    return thread_local.connection
+# 静态资源在 Flask 之前直接返回，不经过 session 和 check_login
+static_assets = StaticAssetMiddleware(app.wsgi_app, get_resource_path('static'))
+app.wsgi_app = static_assets
+app.jinja_env.globals['asset_url'] = static_assets.asset_url
+
+# 构建时预编译的模板字节码(打包在 template_cache 目录中)，开发环境下首次编译后写入 Config.template_cache_dir
+template_cache_dir = get_resource_path('template_cache')
+if not os.path.isdir(template_cache_dir):
+    template_cache_dir = Config.template_cache_dir
+    os.makedirs(template_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = TemplateBytecodeCache(template_cache_dir)
+fragment_cache = FragmentCache(app.jinja_env)
+app.jinja_env.globals['fragment'] = fragment_cache.render
 
 
 def get_cache_device():
@@ -65,6 +71,22 @@ def get_cache_device():
     return None
 
 
+def get_telemetry_device():
+    try:
+        return get_cache_device()
+    finally:
+        close_db_connection()
+
+
+telemetry_pusher = TelemetryPusher(get_telemetry_device)
+
+
+def start_background_tasks():
+    """在 worker 进程中启动后台任务，gunicorn 预加载应用时由 post_fork 调用，避免线程留在 master 中"""
+    telemetry_pusher.start()
+    outbox_dispatcher.start()
+
+
 def insert_device(device_name, device_no, registered_time, device_desc, auth):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -90,20 +112,38 @@ def del_device(device_no):
     conn.commit()
 
 
-def close_db_connection():
-    if hasattr(thread_local, 'connection'):
-        thread_local.connection.close()
-        del thread_local.connection
-
-
 @app.before_request
 def check_login():
     # 如果请求的是登录页，直接放行
     if request.path.startswith('/static/') or request.path == url_for('login'):
         return None
 
-    if session.get('username') != Config.username:
-        return redirect(url_for('login'))
+    if session.get('username') == Config.username:
+        return None
+    if request.path in API_AUTH_PATHS:
+        # 监控系统直接调用，不走登录页
+        if is_api_authorized():
+            return None
+        response = jsonify({'code': Config.fail_code, 'msg': 'Unauthorized'})
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Basic realm="agent"'
+        return response
+    return redirect(url_for('login'))
+
+
+# 除登录 session 外还接受 Basic 认证或 Bearer token 的接口
+API_AUTH_PATHS = ('/api/device_info',)
+
+
+def is_api_authorized():
+    auth = request.authorization
+    if auth is None:
+        return False
+    if auth.type == 'basic':
+        return (hmac.compare_digest(auth.username or '', Config.username)
+                and hmac.compare_digest(auth.password or '', Config.password))
+    token = os.environ.get('deviceInfoToken') or Config.device_info_token
+    return auth.type == 'bearer' and bool(token) and hmac.compare_digest(auth.token or '', token)
 
 
 @app.errorhandler(CSRFError)
@@ -186,6 +226,13 @@ def register():
         'disk': disk,
         'network_interfaces': network_interfaces
     }
+    # 同一台机器的 device_no 不变，先把之前排队的请求(例如删除)送达，保证它们不会在新注册之后才到达
+    try:
+        pending = outbox_dispatcher.flush(device_no)
+    finally:
+        close_db_connection()
+    if pending:
+        return render_template('register.html', errmsg='上一次对该设备的操作尚未同步到边缘服务端，请稍后重试', **data)
     resp_data, ok = http_client.post('/genbu/edge/device/register', data=data)
     if not ok:
         return render_template('register.html', errmsg=resp_data, **data)
@@ -200,16 +247,130 @@ def register():
 
 @app.route('/device_info', methods=['GET'])
 def device_info():
-    hostname = get_hostname()
-    os_info = get_os_info()
-    network_interfaces = get_network_interfaces_details()
-    cpu_info = get_cpu_info()
-    mem_info = get_memory_info()
-    disk_info = get_disk_info()
+    # 同时打开页面的多个请求共用一次采集
+    context = device_info_flight.do('device_info', collect_device_info_page)
+    return render_template('device_info.html', **context)
+
+
+def collect_device_info_page():
+    return {
+        'hostname': get_hostname(),
+        'os_info': get_os_info(),
+        'network_interfaces': get_network_interfaces_details(),
+        'cpu_info': get_cpu_info(),
+        'mem_info': get_memory_info(),
+        'disk_info': get_disk_info(),
+    }
 
-    return render_template('device_info.html', hostname=hostname, os_info=os_info,
-                           network_interfaces=network_interfaces, cpu_info=cpu_info,
-                           mem_info=mem_info, disk_info=disk_info)
+
+# fields -> (采集时间, 响应体, ETag)，轮询方在 Config.device_info_cache_ttl 秒内共享同一份数据
+device_info_cache = {}
+device_info_flight = SingleFlight()
+
+
+def collect_device_info(key, fields):
+    data = get_device_info(fields)
+    body = json.dumps({'code': Config.success_code, 'data': data}, sort_keys=True, ensure_ascii=False)
+    stable = json.dumps(stable_device_info(data), sort_keys=True, ensure_ascii=False)
+    cached = device_info_cache[key] = (time.monotonic(), body, hashlib.sha1(stable.encode('utf-8')).hexdigest())
+    return cached
+
+
+@app.route('/api/device_info', methods=['GET'])
+def api_device_info():
+    """
+    结构化的设备信息，fields=cpu,mem 只返回指定字段。
+    响应带弱 ETag，只覆盖相对稳定的字段(CPU / 内存 / 磁盘的使用量除外)，这些字段没有变化时对 If-None-Match 返回 304；
+    需要实时使用量的调用方不带 If-None-Match。
+    """
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    unknown = [field for field in fields if field not in DEVICE_INFO_FIELDS]
+    if unknown:
+        return jsonify({'code': Config.fail_code, 'msg': f"Unknown fields: {', '.join(unknown)}"}), 400
+    fields = sorted(set(fields))
+    key = ','.join(fields)
+    cached = device_info_cache.get(key)
+    if cached is None or time.monotonic() - cached[0] >= Config.device_info_cache_ttl:
+        # 缓存过期时并发的轮询请求只触发一次采集，不同字段组合互不阻塞
+        cached = device_info_flight.do(('api', key), collect_device_info, key, fields)
+    _, body, etag = cached
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    # 使用量不参与计算，两次响应的内容只是语义上等价
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """agent 自身的运行状态: 边缘服务端(设备操作、遥测)熔断器、outbox 积压"""
+    try:
+        outbox_pending = get_pending_count()
+        outbox_stuck = get_stuck_count()
+    finally:
+        close_db_connection()
+    return jsonify({'code': Config.success_code, 'data': {
+        'edge_server': http_client.breaker.snapshot(),
+        'edge_telemetry': telemetry_client.breaker.snapshot(),
+        'outbox_pending': outbox_pending,
+        'outbox_stuck': outbox_stuck,
+    }})
+
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """
+    CPU 采样剖析 seconds 秒，返回 collapsed stacks 文件，可以直接用 flamegraph.pl 或 speedscope 打开:
+        curl -b cookie 'http://agent:5000/debug/profile?seconds=10' -o agent.folded
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', Config.profile_interval))
+    except ValueError:
+        return jsonify({'code': Config.fail_code, 'msg': 'seconds and interval must be numbers'}), 400
+    text, ok = profile_cpu(seconds, interval)
+    if not ok:
+        return jsonify({'code': Config.fail_code, 'msg': text}), 409
+    filename = time.strftime('agent-%Y%m%d-%H%M%S.folded')
+    return Response(text, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}', 'Cache-Control': 'no-store'})
+
+
+# 调试接口供 curl 带 session cookie 调用，拿不到页面中的 CSRF token
+@app.route('/debug/tracemalloc/start', methods=['POST'])
+@csrf.exempt
+def debug_tracemalloc_start():
+    """curl -b cookie -X POST 'http://agent:5000/debug/tracemalloc/start' -d frames=5 -d seconds=300"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        msg, ok = tracemalloc_session.start(data.get('frames'), data.get('seconds'))
+    except ValueError:
+        return jsonify({'code': Config.fail_code, 'msg': 'frames and seconds must be numbers'}), 400
+    return jsonify({'code': Config.success_code if ok else Config.fail_code, 'msg': msg})
+
+
+@app.route('/debug/tracemalloc/stop', methods=['POST'])
+@csrf.exempt
+def debug_tracemalloc_stop():
+    msg, ok = tracemalloc_session.stop()
+    return jsonify({'code': Config.success_code if ok else Config.fail_code, 'msg': msg})
+
+
+@app.route('/debug/tracemalloc', methods=['GET'])
+def debug_tracemalloc():
+    """
+    当前占用最多的分配位置(top)以及相对基线的增长(diff)，基线为开启时的快照；
+    reset=1 时把本次快照作为新的基线，下一次只看这之后的增长。
+    """
+    limit = request.args.get('limit', 20, type=int)
+    group_by = request.args.get('group_by', 'lineno')
+    report, ok = tracemalloc_session.report(limit, group_by, request.args.get('reset') == '1')
+    if not ok:
+        return jsonify({'code': Config.fail_code, 'msg': report}), 400
+    return jsonify({'code': Config.success_code, 'data': report})
 
 
 @app.route('/device_manage', methods=['GET'])
@@ -230,21 +391,58 @@ def device_manage():
     return render_template('device_manage.html', devices=devices)
 
 
-@app.route('/init_device', methods=['GET'])
-def init_device():
+def wait_for_init_rollout(k8s_host, k8s_token, scripts, namespaces):
+    """
+    等待初始化脚本中的 Deployment / DaemonSet / StatefulSet 以及 namespaces 中全部工作负载(helm 不带 --wait 安装)就绪，
+    所有 namespace 共用 Config.init_rollout_timeout，返回 ({"namespace/Kind/name": 状态}, ok)
+    """
+    targets = {namespace: None for namespace in namespaces}
+    for script in scripts:
+        for obj in yaml.safe_load_all(script):
+            if not isinstance(obj, dict) or obj.get('kind') not in ('Deployment', 'DaemonSet', 'StatefulSet'):
+                continue
+            metadata = obj.get('metadata') or {}
+            namespace = metadata.get('namespace') or 'default'
+            if namespace in targets and targets[namespace] is None:
+                continue
+            targets.setdefault(namespace, []).append(f"{obj['kind']}/{metadata['name']}")
+    deadline = time.time() + Config.init_rollout_timeout
+    statuses = {}
+    all_ok = True
+    with client_registry.lease(k8s_host, k8s_token) as k8s:
+        for namespace, names in targets.items():
+            ok, result = k8s.wait_for_rollout(namespace, targets=names, timeout=max(int(deadline - time.time()), 1))
+            for key, status in result.items():
+                statuses[f'{namespace}/{key}'] = status
+                if status != 'ready':
+                    Logger.error(f'Workload {namespace}/{key} is not ready: {status}')
+            all_ok = all_ok and ok
+    return statuses, all_ok
+
+
+def run_init_device(progress):
+    """设备初始化流程，每一步的开始/结束和命令输出都通过 progress 推送，返回 (msg, ok)"""
+
+    def on_output(command, stream, line):
+        progress.publish('output', command=command, stream=stream, line=line)
+
+    subscribe_output(on_output)
     try:
-        msg, ok = init_k3s()
+        msg, ok = progress.run_step('Initialize k3s', init_k3s)
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': msg})
-        ok = cp_k3s_config()
+            return msg, False
+        ok = progress.run_step('Copy k3s config', cp_k3s_config)
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': 'Failed to copy k3s config'})
-        device = get_cache_device()
+            return 'Failed to copy k3s config', False
+        try:
+            device = get_cache_device()
+        finally:
+            close_db_connection()
         if not device:
-            return jsonify({'code': Config.fail_code, 'msg': 'Device not registered'})
-        cluster_info = get_cluster_info()
+            return 'Device not registered', False
+        cluster_info = progress.run_step('Get cluster info', get_cluster_info)
         if not cluster_info:
-            return jsonify({'code': Config.fail_code, 'msg': 'Failed to get cluster info'})
+            return 'Failed to get cluster info', False
 
         data = {
             'auth': device['auth'],
@@ -254,54 +452,116 @@ def init_device():
             'num': cluster_info['node_count'],
             'version': cluster_info['version'],
         }
-        response, ok = http_client.post('/genbu/edge/device/init_script', data=data)
+        response, ok = progress.run_step('Fetch init script', http_client.post, '/genbu/edge/device/init_script',
+                                         data=data, cache_key=device['device_no'])
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': "Failed to get init script"})
+            return "Failed to get init script", False
         init_script = response['init_script']
-        ok = apply_kubernetes_yaml(init_script)
+        ok = progress.run_step('Apply init script', apply_kubernetes_yaml, init_script, ledger_key='init_script')
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': 'Failed to apply Kubernetes YAML'})
+            return 'Failed to apply Kubernetes YAML', False
         fluent_bit_script = response.get('fluent_bit_script', None)
         if fluent_bit_script:
-            ok = create_configmap_tz()
+            ok = progress.run_step('Create configmap tz', create_configmap_tz)
             if not ok:
-                return jsonify({'code': Config.fail_code, 'msg': 'Failed to create configmap tz'})
-            ok = apply_kubernetes_yaml(fluent_bit_script)
+                return 'Failed to create configmap tz', False
+            ok = progress.run_step('Apply fluent-bit script', apply_kubernetes_yaml, fluent_bit_script,
+                                   ledger_key='fluent_bit_script')
             if not ok:
-                return jsonify({'code': Config.fail_code, 'msg': 'Failed to apply fluent-bit YAML'})
+                return 'Failed to apply fluent-bit YAML', False
         telegraf_script = response.get('telegraf_script', None)
         if telegraf_script:
-            ok = install_helm()
+            ok = progress.run_step('Install helm', install_helm)
             if not ok:
-                return jsonify({'code': Config.fail_code, 'msg': 'Failed to install helm'})
+                return 'Failed to install helm', False
             prometheus_script = response.get('prometheus_script', None)
-            ok = install_prometheus(prometheus_script)
+            ok = progress.run_step('Install prometheus', install_prometheus, prometheus_script)
             if not ok:
-                return jsonify({'code': Config.fail_code, 'msg': 'Failed to install prometheus'})
-            ok = install_telegraf(telegraf_script)
+                return 'Failed to install prometheus', False
+            ok = progress.run_step('Install telegraf', install_telegraf, telegraf_script)
             if not ok:
-                return jsonify({'code': Config.fail_code, 'msg': 'Failed to install telegraf'})
-        k8s_token, ok = get_k8s_token()
+                return 'Failed to install telegraf', False
+        k8s_token, ok = progress.run_step('Get k8s token', get_k8s_token)
+        if not ok:
+            return 'Failed to get k8s token', False
+        k8s_host, ok = progress.run_step('Get k8s host', get_k8s_svc)
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': 'Failed to get k8s token'})
-        k8s_host, ok = get_k8s_svc()
+            return 'Failed to get k8s host', False
+        statuses, ok = progress.run_step('Wait for workloads', wait_for_init_rollout, k8s_host, k8s_token,
+                                         [init_script, fluent_bit_script or ''],
+                                         ['monitoring'] if telegraf_script else [])
         if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': 'Failed to get k8s host'})
+            return 'Workloads are not ready: ' + ', '.join(
+                f'{key} {status}' for key, status in statuses.items() if status != 'ready'), False
         data['k8s_url'] = k8s_host
         data['k8s_token'] = k8s_token
-        response, ok = http_client.post('/genbu/edge/device/init_success', data=data)
-        if not ok:
-            return jsonify({'code': Config.fail_code, 'msg': response})
+        # 初始化结果通过 outbox 异步上报，边缘服务端短暂不可达不会导致整个初始化失败
         try:
+            progress.run_step('Report init success', enqueue, device['device_no'], 'post',
+                              '/genbu/edge/device/init_success', data=data,
+                              dedup_key=f"init_success:{device['device_no']}")
             update_device(device['device_no'])
         except Exception as e:
-            return jsonify({'code': Config.fail_code, 'msg': str(e)})
+            return str(e), False
         finally:
             close_db_connection()
-        return jsonify({'code': Config.success_code, 'msg': 'Device initialized successfully'})
-    except Exception as e:
-        Logger.error('Failed to init_device: %s', traceback.format_exc())
-        return jsonify({'code': Config.fail_code, 'msg': str(e)})
+        return 'Device initialized successfully', True
+    finally:
+        unsubscribe_output(on_output)
+
+
+# 初始化会重启 k3s、安装 helm chart，多个 worker 之间通过文件锁串行执行
+init_runner = ProgressRunner('init_device', run_init_device, lock_file=Config.init_lock_file)
+
+
+@app.route('/init_device', methods=['POST'])
+def init_device():
+    """启动(或加入进行中的)初始化并等待结果，供不支持 EventSource 的浏览器使用"""
+    msg, ok = init_runner.start().wait()
+    return jsonify({'code': Config.success_code if ok else Config.fail_code, 'msg': msg})
+
+
+@app.route('/init_device/start', methods=['POST'])
+def init_device_start():
+    """启动一次初始化，已经在进行时返回当前这次运行，之后通过 /init_device/stream?run_id= 订阅进度"""
+    channel = init_runner.start()
+    return jsonify({'code': Config.success_code, 'data': {'run_id': channel.run_id}})
+
+
+@app.route('/init_device/stream', methods=['GET'])
+def init_device_stream():
+    """
+    以 Server-Sent Events 推送 run_id 这次初始化的进度，只加入已经通过 POST 启动的运行，不会触发初始化。
+    浏览器断线重连会带上 Last-Event-ID，此时只续传该次运行剩余的事件。
+    """
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_run_id, _, last_seq = last_event_id.partition(':')
+    run_id = request.args.get('run_id') or last_run_id
+    channel = init_runner.current
+    if channel is None or (run_id and channel.run_id != run_id):
+        # 204 会让 EventSource 停止重连
+        return Response(status=204)
+    after_seq = int(last_seq) if last_run_id == channel.run_id and last_seq.isdigit() else 0
+
+    def generate():
+        subscriber = channel.subscribe(after_seq)
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # 注释行作为心跳，防止中间代理断开空闲连接
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'id: %s:%s\nevent: %s\ndata: %s\n\n' % (
+                    channel.run_id, event['seq'], event['event'], json.dumps(event, ensure_ascii=False))
+                if event['event'] == 'done':
+                    break
+        finally:
+            channel.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/delete_device', methods=['POST'])
@@ -309,14 +569,61 @@ def delete_device():
     data = request.get_json()
     device_no = data.get('device_no')
     try:
-        http_client.delete('/genbu/edge/device/delete', data={'device_no': device_no})
+        enqueue(device_no, 'delete', '/genbu/edge/device/delete', data={'device_no': device_no},
+                dedup_key=f'delete:{device_no}')
         del_device(device_no)
     except Exception as e:
         Logger.error('Failed to delete device: %s', traceback.format_exc())
         return jsonify({'code': Config.fail_code, 'msg': str(e)})
+    finally:
+        close_db_connection()
     return jsonify({'code': Config.success_code, 'msg': 'Device deleted successfully'})
 
 
+pod_log_streams = threading.BoundedSemaphore(Config.pod_log_max_streams)
+
+
+@app.route('/pod_log/<namespace>/<name>', methods=['GET'])
+def pod_log(namespace, name):
+    """
+    以 chunked 响应转发 pod 日志，支持 follow / tail_lines / since_seconds / limit_bytes / container 参数。
+    每写出一块才从上游读下一块，客户端读得慢时上游读取也随之暂停；并发流数量受 Config.pod_log_max_streams 限制。
+    """
+    if not pod_log_streams.acquire(blocking=False):
+        return jsonify({'code': Config.fail_code, 'msg': 'Too many concurrent log streams'}), 429
+    # 日志流可能持续很久，租用期间客户端不会被 client_registry 淘汰关闭
+    lease = ExitStack()
+    try:
+        k8s_client = lease.enter_context(client_registry.lease(Config.k8s_host, Config.k8s_token))
+        ok, stream = k8s_client.stream_namespaced_pod_log(
+            name, namespace,
+            follow=request.args.get('follow', '').lower() in ('1', 'true'),
+            tail_lines=request.args.get('tail_lines', type=int),
+            since_seconds=request.args.get('since_seconds', type=int),
+            limit_bytes=request.args.get('limit_bytes', type=int),
+            **({'container': request.args['container']} if request.args.get('container') else {})
+        )
+    except Exception as e:
+        lease.close()
+        pod_log_streams.release()
+        Logger.error('Failed to open pod log stream: %s', traceback.format_exc())
+        return jsonify({'code': Config.fail_code, 'msg': str(e)})
+    if not ok:
+        lease.close()
+        pod_log_streams.release()
+        return jsonify({'code': Config.fail_code, 'msg': stream})
+
+    def on_close():
+        # 客户端断开或读完时由 WSGI 服务器调用，生成器未开始迭代时也会执行
+        stream.close()
+        lease.close()
+        pod_log_streams.release()
+
+    response = Response(iter(stream), mimetype='text/plain', headers={'X-Accel-Buffering': 'no'})
+    response.call_on_close(on_close)
+    return response
+
+
 @app.route('/get_pkg', methods=['GET'])
 def get_pkg():
     path = get_resource_path('pkg')
@@ -324,4 +631,5 @@ def get_pkg():
 
 
 if __name__ == '__main__':
+    start_background_tasks()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,241 @@
+"""
+本地模拟的 genbu 边缘服务端，用于离线压测 / 性能分析 proxy.HttpClient 相关流程。
+
+实现 register、init_script、init_success、delete、telemetry 五个接口，返回与真实服务端一致的
+{"code": 20000, "response": ..., "message": ...} 结构，并支持注入延迟、错误、慢响应体和超大 init 脚本。
+
+用法:
+    python mock_edge_server.py --port 6006 --latency 0.2 --jitter 0.1 --error-rate 0.05
+    edgeServerHost=http://127.0.0.1:6006 python wsgi.py 5000
+
+所有参数也可以通过环境变量 mockEdge<参数名> 设置，例如 mockEdgeLatency=0.5。
+"""
+if __name__ == '__main__':
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+
+from flask import Flask, Response, request
+
+SUCCESS_CODE = 20000
+FAIL_CODE = 50000
+
+app = Flask(__name__)
+
+
+class FaultConfig:
+    # 每个请求固定增加的延迟(秒)及随机抖动
+    latency = 0.0
+    jitter = 0.0
+    # 返回错误的概率，错误中 http_error_ratio 比例为 HTTP 500，其余为业务错误码
+    error_rate = 0.0
+    http_error_ratio = 0.5
+    # 慢响应体：把响应拆成 chunk_size 大小分块，每块间隔 chunk_delay 秒
+    chunk_delay = 0.0
+    chunk_size = 1024
+    # init_script 的目标大小(KB)，用于模拟超大脚本
+    init_script_kb = 4
+    # 是否在 init_script 中返回 fluent-bit / telegraf / prometheus 脚本
+    with_fluent_bit = True
+    with_telegraf = False
+
+
+class Stats:
+    requests = 0
+    errors = 0
+    not_modified = 0
+    telemetry_batches = 0
+    telemetry_samples = 0
+    telemetry_bytes = 0
+
+
+def envelope(response=None, code=SUCCESS_CODE, message='success'):
+    return {'code': code, 'response': response, 'message': message}
+
+
+def build_init_script(size_kb):
+    """生成大约 size_kb KB 的多文档 YAML，ConfigMap 数量随大小增长"""
+    docs = [
+        "apiVersion: v1\n"
+        "kind: Namespace\n"
+        "metadata:\n"
+        "  name: snb-system\n"
+    ]
+    payload = 'x' * 900
+    index = 0
+    # 累计长度，避免每追加一个文档都重新求和
+    total = len(docs[0])
+    while total < size_kb * 1024:
+        doc = (
+            "apiVersion: v1\n"
+            "kind: ConfigMap\n"
+            "metadata:\n"
+            f"  name: mock-config-{index}\n"
+            "  namespace: snb-system\n"
+            "data:\n"
+            f"  payload: {payload}\n"
+        )
+        docs.append(doc)
+        total += len(doc)
+        index += 1
+    return "---\n".join(docs)
+
+
+FLUENT_BIT_SCRIPT = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: fluent-bit-config
+  namespace: kube-system
+data:
+  fluent-bit.conf: |
+    [SERVICE]
+        Flush 5
+"""
+
+TELEGRAF_SCRIPT = """config:
+  outputs:
+  - influxdb:
+      urls:
+        - "http://127.0.0.1:8428"
+      database: "telegraf"
+service:
+  enabled: false
+"""
+
+
+def render(body, status=200):
+    """按照故障配置输出响应体，chunk_delay > 0 时按块慢速写出"""
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    if FaultConfig.chunk_delay <= 0:
+        return Response(data, status=status, mimetype='application/json')
+
+    def generate():
+        for i in range(0, len(data), FaultConfig.chunk_size):
+            yield data[i:i + FaultConfig.chunk_size]
+            time.sleep(FaultConfig.chunk_delay)
+
+    return Response(generate(), status=status, mimetype='application/json')
+
+
+@app.before_request
+def inject_faults():
+    Stats.requests += 1
+    delay = FaultConfig.latency + random.uniform(0, FaultConfig.jitter)
+    if delay > 0:
+        time.sleep(delay)
+    if FaultConfig.error_rate > 0 and random.random() < FaultConfig.error_rate:
+        Stats.errors += 1
+        if random.random() < FaultConfig.http_error_ratio:
+            return Response('mock internal server error', status=500)
+        return render(envelope(code=FAIL_CODE, message='mock business error'))
+    return None
+
+
+@app.route('/genbu/edge/device/register', methods=['POST'])
+def register():
+    data = request.get_json(silent=True) or {}
+    if not data.get('device_no'):
+        return render(envelope(code=FAIL_CODE, message='device_no is required'))
+    return render(envelope({
+        'register_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'auth': uuid.uuid4().hex,
+    }))
+
+
+@app.route('/genbu/edge/device/init_script', methods=['POST'])
+def init_script():
+    response = {'init_script': build_init_script(FaultConfig.init_script_kb)}
+    if FaultConfig.with_fluent_bit:
+        response['fluent_bit_script'] = FLUENT_BIT_SCRIPT
+    if FaultConfig.with_telegraf:
+        response['telegraf_script'] = TELEGRAF_SCRIPT
+        response['prometheus_script'] = None
+    # 脚本内容不变时 ETag 不变，客户端带 If-None-Match 命中时返回 304
+    body = envelope(response)
+    etag = '"%s"' % hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+    if request.headers.get('If-None-Match') == etag:
+        Stats.not_modified += 1
+        return Response(status=304, headers={'ETag': etag})
+    result = render(body)
+    result.headers['ETag'] = etag
+    return result
+
+
+@app.route('/genbu/edge/device/init_success', methods=['POST'])
+def init_success():
+    data = request.get_json(silent=True) or {}
+    if not data.get('device_no'):
+        return render(envelope(code=FAIL_CODE, message='device_no is required'))
+    return render(envelope())
+
+
+@app.route('/genbu/edge/device/delete', methods=['DELETE'])
+def delete():
+    return render(envelope())
+
+
+@app.route('/genbu/edge/device/telemetry', methods=['POST'])
+def telemetry():
+    body = request.get_data()
+    Stats.telemetry_bytes += len(body)
+    if request.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    data = json.loads(body)
+    if not data.get('device_no'):
+        return render(envelope(code=FAIL_CODE, message='device_no is required'))
+    Stats.telemetry_batches += 1
+    Stats.telemetry_samples += 1 + len(data.get('deltas', []))
+    return render(envelope())
+
+
+@app.route('/mock/stats', methods=['GET'])
+def stats():
+    return {'requests': Stats.requests, 'errors': Stats.errors, 'not_modified': Stats.not_modified,
+            'telemetry_batches': Stats.telemetry_batches, 'telemetry_samples': Stats.telemetry_samples,
+            'telemetry_bytes': Stats.telemetry_bytes}
+
+
+def parse_args():
+    def env(name, default):
+        return os.environ.get('mockEdge' + name, default)
+
+    parser = argparse.ArgumentParser(description='Mock genbu edge server')
+    parser.add_argument('--host', default=env('Host', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(env('Port', 6006)))
+    parser.add_argument('--latency', type=float, default=float(env('Latency', 0)))
+    parser.add_argument('--jitter', type=float, default=float(env('Jitter', 0)))
+    parser.add_argument('--error-rate', type=float, default=float(env('ErrorRate', 0)))
+    parser.add_argument('--http-error-ratio', type=float, default=float(env('HttpErrorRatio', 0.5)))
+    parser.add_argument('--chunk-delay', type=float, default=float(env('ChunkDelay', 0)))
+    parser.add_argument('--chunk-size', type=int, default=int(env('ChunkSize', 1024)))
+    parser.add_argument('--init-script-kb', type=int, default=int(env('InitScriptKb', 4)))
+    parser.add_argument('--no-fluent-bit', action='store_true')
+    parser.add_argument('--with-telegraf', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from gevent import pywsgi
+
+    args = parse_args()
+    FaultConfig.latency = args.latency
+    FaultConfig.jitter = args.jitter
+    FaultConfig.error_rate = args.error_rate
+    FaultConfig.http_error_ratio = args.http_error_ratio
+    FaultConfig.chunk_delay = args.chunk_delay
+    FaultConfig.chunk_size = args.chunk_size
+    FaultConfig.init_script_kb = args.init_script_kb
+    FaultConfig.with_fluent_bit = not args.no_fluent_bit
+    FaultConfig.with_telegraf = args.with_telegraf
+    print(f'Starting mock edge server on {args.host}:{args.port}...')
+    pywsgi.WSGIServer((args.host, args.port), app, log=None).serve_forever()
@@ -0,0 +1,186 @@
+"""
+发往边缘服务端的状态变更请求(删除设备、上报初始化完成等)的本地 outbox。
+
+请求先写入 SQLite 的 outbox 表，页面立即得到响应；后台的 OutboxDispatcher 负责投递:
+同一设备的请求严格按写入顺序逐个发送，前一个没有成功之前后面的不会发出；失败后指数退避重试，
+退避达到 Config.outbox_retry_max 后按该间隔一直重试，不会丢弃请求(init_success 中带有 k8s 访问凭证)；
+尝试次数达到 Config.outbox_max_attempts 时记录错误日志，积压情况通过 /api/metrics 暴露。
+相同 dedup_key 的未投递请求只保留一条(使用最新的请求体)；送达的请求立即删除。
+投递前先把该行标记为 sending 并设置租约到期时间，多个 worker 或 flush 同时投递时同一请求不会重复发送；
+投递进程中途退出时租约到期后重新投递。
+"""
+import json
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from circuit_breaker import Rejected
+from config import Config
+from db import get_db_connection, close_db_connection
+from log_tool import Logger
+from proxy import http_client
+from singleflight import FileLock
+
+_wakeup = threading.Event()
+
+
+def enqueue(device_no, method, uri, data=None, dedup_key=None):
+    """记录一个待投递的请求，返回 outbox id；method 为 post 或 delete"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO outbox (device_no, method, uri, payload, dedup_key, created_time) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (dedup_key) WHERE status = 'pending' DO UPDATE SET payload = excluded.payload",
+        (device_no, method, uri, json.dumps(data), dedup_key, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    outbox_id = cursor.lastrowid
+    if dedup_key is not None:
+        # 走 DO UPDATE 分支时 lastrowid 没有意义，按 dedup_key 查出实际的行
+        cursor.execute("SELECT id FROM outbox WHERE dedup_key = ? AND status = 'pending'", (dedup_key,))
+        outbox_id = cursor.fetchone()[0]
+    conn.commit()
+    _wakeup.set()
+    return outbox_id
+
+
+def get_pending_count(device_no=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if device_no is None:
+        cursor.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending') AND device_no = ?",
+                       (device_no,))
+    return cursor.fetchone()[0]
+
+
+def get_stuck_count():
+    """尝试次数已经达到 Config.outbox_max_attempts 仍未送达的请求数"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending') AND attempts >= ?",
+                   (Config.outbox_max_attempts,))
+    return cursor.fetchone()[0]
+
+
+class OutboxDispatcher:
+
+    def __init__(self, client=None):
+        self.client = client or http_client
+        self._lock = FileLock(Config.outbox_lock_file)
+        self._started = False
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        多个 gunicorn worker 中只有拿到文件锁的那个负责投递，其他 worker 写入的请求在下一次轮询时发出。
+        没有拿到锁的 worker 每个轮询周期重试一次，平滑重启时旧 worker 退出后由新 worker 接手。
+        """
+        if self._started:
+            return False
+        self._started = True
+        threading.Thread(target=self._run, name='outbox', daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._lock.held or self._lock.acquire(blocking=False):
+                try:
+                    self.dispatch()
+                except Exception:
+                    Logger.error(f'Failed to dispatch outbox: {traceback.format_exc()}')
+                finally:
+                    close_db_connection()
+            _wakeup.wait(Config.outbox_poll_interval)
+            _wakeup.clear()
+
+    def dispatch(self, device_no=None):
+        """按设备顺序投递到期的待发请求，device_no 不为空时只投递该设备的请求，返回本轮投递成功的条数"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # 清理旧版本留下的已送达 / 已代替的请求
+        cursor.execute("DELETE FROM outbox WHERE status IN ('delivered', 'superseded')")
+        conn.commit()
+        handled = 0
+        while True:
+            # 每个设备只取最早的一条，保证同一设备的请求按顺序投递
+            if device_no is None:
+                cursor.execute(
+                    "SELECT id, device_no, method, uri, payload, attempts, next_attempt FROM outbox "
+                    "WHERE id IN (SELECT MIN(id) FROM outbox WHERE status IN ('pending', 'sending') "
+                    "GROUP BY device_no) ORDER BY id")
+            else:
+                cursor.execute(
+                    "SELECT id, device_no, method, uri, payload, attempts, next_attempt FROM outbox "
+                    "WHERE id = (SELECT MIN(id) FROM outbox WHERE status IN ('pending', 'sending') AND device_no = ?)",
+                    (device_no,))
+            due = [row for row in cursor.fetchall() if row[6] <= time.time()]
+            if not due:
+                return handled
+            progressed = False
+            for outbox_id, _, method, uri, payload, attempts, _ in due:
+                if self._deliver(conn, outbox_id, method, uri, json.loads(payload), attempts):
+                    handled += 1
+                    progressed = True
+            if not progressed:
+                return handled
+
+    def flush(self, device_no):
+        """
+        忽略退避立即投递该设备所有待发请求，返回仍未送达的条数。
+        重新注册之前调用，避免旧的删除请求在新注册之后才送达把新注册删掉。
+        """
+        conn = get_db_connection()
+        # 正在投递(sending)的请求保留租约，不会被重复发送
+        conn.execute("UPDATE outbox SET next_attempt = 0 WHERE status = 'pending' AND device_no = ?", (device_no,))
+        conn.commit()
+        self.dispatch(device_no)
+        return get_pending_count(device_no)
+
+    def _deliver(self, conn, outbox_id, method, uri, data, attempts):
+        now = time.time()
+        # 租约: 投递期间标记为 sending 并推迟 next_attempt，其他投递方看到的是未到期的请求
+        cursor = conn.execute(
+            "UPDATE outbox SET status = 'sending', next_attempt = ? "
+            "WHERE id = ? AND status IN ('pending', 'sending') AND next_attempt <= ?",
+            (now + Config.outbox_lease, outbox_id, now))
+        conn.commit()
+        if cursor.rowcount == 0:
+            return False
+        if method == 'delete':
+            response, ok = self.client.delete(uri, data=data)
+        else:
+            response, ok = self.client.post(uri, data=data)
+        if isinstance(response, Rejected):
+            # 熔断器打开，请求没有真正发出，不计入尝试次数，等到熔断器允许探测时再投递
+            conn.execute("UPDATE outbox SET status = 'pending', next_attempt = ? WHERE id = ?",
+                         (time.time() + max(response.retry_in, 1.0), outbox_id))
+            conn.commit()
+            return False
+        if ok:
+            # 送达后直接删除，init_success 的请求体中带有 k8s token，不在本地长期保留
+            conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+            conn.commit()
+            return True
+        attempts += 1
+        if attempts == Config.outbox_max_attempts:
+            Logger.error(f'Outbox request {outbox_id} {method} {uri} still undelivered after {attempts} attempts, '
+                         f'retrying every {Config.outbox_retry_max}s: {response}')
+        delay = min(Config.outbox_retry_base * 2 ** min(attempts - 1, 30), Config.outbox_retry_max)
+        try:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(response), outbox_id))
+        except sqlite3.IntegrityError:
+            # 投递期间写入了相同 dedup_key 的新请求，旧请求由新请求代替
+            conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+        conn.commit()
+        return False
+
+
+outbox_dispatcher = OutboxDispatcher()
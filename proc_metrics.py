@@ -0,0 +1,109 @@
+"""
+直接读取 /proc 的系统指标采集，作为 psutil 的轻量替代。
+
+/proc/stat、/proc/meminfo、/proc/net/dev 的文件描述符一直保持打开，每次采样用 preadv 从头读入复用的缓冲区，
+只解析需要的字段；CPU 使用率由两次采样之间的差值计算，不需要 sleep。
+适合在低配置的 ARM 边缘节点上频繁采样，utils 通过 Config.metrics_backend 在它和 psutil 之间切换。
+"""
+import os
+import threading
+
+# /proc/meminfo 中用到的字段，除第一行外带上换行符，避免 Cached: 匹配到 SwapCached:
+MEMINFO_FIELDS = (b'MemTotal:', b'\nMemFree:', b'\nMemAvailable:', b'\nBuffers:', b'\nCached:', b'\nSReclaimable:')
+
+class ProcFile:
+    """保持打开的 /proc 文件，read() 返回复用缓冲区上的 memoryview，内容超出缓冲区时自动扩容"""
+
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.buffer = bytearray(size)
+
+    def read(self):
+        while True:
+            n = os.preadv(self.fd, [self.buffer], 0)
+            if n < len(self.buffer):
+                return memoryview(self.buffer)[:n]
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ProcMetrics:
+    """所有方法返回数值(字节、百分比)，由调用方负责格式化；CPU 使用率由 utils.CpuSampler 按 cpu_times 的差值计算"""
+
+    def __init__(self, proc_root='/proc'):
+        self._stat = ProcFile(os.path.join(proc_root, 'stat'))
+        self._meminfo = ProcFile(os.path.join(proc_root, 'meminfo'), 8192)
+        self._net_dev = ProcFile(os.path.join(proc_root, 'net/dev'), 8192)
+        self._lock = threading.Lock()
+
+    def cpu_times(self):
+        """返回 (总时间, 空闲时间)，单位 jiffies，空闲包含 iowait；guest 已经计入 user，不重复累加"""
+        with self._lock:
+            data = self._stat.read()
+            buffer = data.obj
+            # 第一行 "cpu  user nice system idle iowait irq softirq steal guest guest_nice"，字段之间只有一个空格；
+            # 在缓冲区上逐个查找字段边界，只取前 8 个，不复制整行也不生成字段列表
+            start = buffer.find(b' ', 4, len(data))
+            total = idle = 0
+            for index in range(8):
+                end = buffer.find(b' ', start + 1)
+                value = int(buffer[start:end])
+                total += value
+                if index == 3 or index == 4:
+                    idle += value
+                start = end
+        return total, idle
+
+    def memory(self):
+        """返回 {'total', 'available', 'used', 'free', 'percent'}，used 与 psutil 的计算方式一致"""
+        values = {}
+        with self._lock:
+            data = self._meminfo.read()
+            buffer = data.obj
+            size = len(data)
+            for field in MEMINFO_FIELDS:
+                start = buffer.find(field, 0, size)
+                if start < 0:
+                    values[field] = 0
+                    continue
+                start += len(field)
+                end = buffer.find(b'kB', start, size)
+                values[field] = int(buffer[start:end]) * 1024
+        total = values[b'MemTotal:']
+        free = values[b'\nMemFree:']
+        available = values[b'\nMemAvailable:'] or free
+        used = total - free - values[b'\nBuffers:'] - values[b'\nCached:'] - values[b'\nSReclaimable:']
+        if used < 0:
+            used = total - free
+        percent = round((total - available) / total * 100, 1) if total else 0.0
+        return {'total': total, 'available': available, 'used': used, 'free': free, 'percent': percent}
+
+    def net_io(self):
+        """返回 {网卡名: (接收字节数, 发送字节数)}"""
+        result = {}
+        with self._lock:
+            data = self._net_dev.read()
+            buffer = data.obj
+            size = len(data)
+            # 跳过两行表头，之后逐行只切出这一行，接收字节数是第 1 个字段，发送字节数是第 9 个字段
+            start = buffer.find(b'\n', buffer.find(b'\n', 0, size) + 1, size) + 1
+            while 0 < start < size:
+                end = buffer.find(b'\n', start, size)
+                if end < 0:
+                    end = size
+                name, _, counters = buffer[start:end].partition(b':')
+                if counters:
+                    fields = counters.split(None, 9)
+                    result[name.strip().decode()] = (int(fields[0]), int(fields[8]))
+                start = end + 1
+        return result
+
+    def close(self):
+        for proc_file in (self._stat, self._meminfo, self._net_dev):
+            proc_file.close()
+
@@ -0,0 +1,199 @@
+"""
+运行中的 agent 进程的按需 CPU / 内存剖析。
+
+CPU: 在原生线程中每隔 interval 秒读取一次所有线程的调用栈(sys._current_frames)，统计 N 秒后输出
+collapsed stacks 文本(每行 "线程;外层函数;...;内层函数 次数")，可以直接交给 flamegraph.pl / speedscope。
+gevent 下所有协程都在主线程中，采到的是当时正在运行的那个协程；空闲时主线程停在 hub 中。
+没有在剖析时不安装任何钩子，空闲开销为零。
+
+内存: 按需开启 tracemalloc，开启时记录一份基线快照，之后可以查看当前占用最多的分配位置以及相对基线的增长；
+超过 Config.tracemalloc_max_seconds 自动关闭，避免忘记关闭后一直承担 tracemalloc 的开销。
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from gevent import monkey
+
+from config import Config
+from log_tool import Logger
+
+# 采样线程运行在原生线程中，必须使用未 patch 的 sleep / get_ident
+_sleep = monkey.get_original('time', 'sleep')
+_get_ident = monkey.get_original('_thread', 'get_ident')
+_MAIN_THREAD_IDENT = _get_ident()
+MAX_STACK_DEPTH = 128
+
+# 由采样线程释放，使用原生锁: gevent patch 后的 Lock 不能在其他原生线程中释放
+_profile_lock = monkey.get_original('_thread', 'allocate_lock')()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+def sample_stacks(seconds, interval):
+    """采样 seconds 秒，返回 {collapsed stack: 次数}，在原生线程中调用"""
+    counts = collections.Counter()
+    own_ident = _get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            thread = 'MainThread' if ident == _MAIN_THREAD_IDENT else f'thread-{ident}'
+            stack.append(thread)
+            counts[';'.join(reversed(stack))] += 1
+        # 最后一次睡眠不超过剩余时间，interval 较大时也能按时返回
+        _sleep(max(min(interval, deadline - time.monotonic()), 0))
+    return counts
+
+
+def _sample_and_release(seconds, interval):
+    try:
+        return sample_stacks(seconds, interval)
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(counts):
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def profile_cpu(seconds, interval=None):
+    """
+    同一时刻只允许一次剖析，返回 (collapsed stacks 文本, ok)。
+    采样在独立的原生线程中进行，调用方(请求协程)等待期间不阻塞事件循环。
+    """
+    from concurrency import NativeCall
+
+    seconds = min(max(float(seconds), 0.1), Config.profile_max_seconds)
+    interval = min(max(float(interval or Config.profile_interval), 0.001), seconds)
+    if not _profile_lock.acquire(False):
+        return 'Another CPU profile is running', False
+    Logger.info(f'CPU profiling for {seconds}s, interval {interval}s')
+    try:
+        # 锁由采样线程退出时释放，等待超时后采样线程仍占着线程池，期间不允许开始新的剖析
+        call = NativeCall(_sample_and_release, seconds, interval)
+    except BaseException:
+        _profile_lock.release()
+        raise
+    try:
+        counts = call.get(timeout=seconds + 30)
+    except TimeoutError:
+        Logger.error(f'CPU profile did not finish within {seconds + 30}s')
+        return 'CPU profile timed out', False
+    return format_collapsed(counts), True
+
+
+class TracemallocSession:
+
+    def __init__(self):
+        self.baseline = None
+        self.started_at = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self, frames=None, max_seconds=None):
+        """返回 (msg, ok)；已经在跟踪(包括其他代码开启的)时不重复开启"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                return 'tracemalloc is already tracing', False
+            frames = min(max(int(frames or Config.tracemalloc_frames), 1), 64)
+            max_seconds = min(float(max_seconds or Config.tracemalloc_max_seconds), Config.tracemalloc_max_seconds)
+            tracemalloc.start(frames)
+            self.baseline = self._take_snapshot()
+            self.started_at = time.time()
+            self._timer = threading.Timer(max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        Logger.info(f'tracemalloc started with {frames} frames, auto stop after {max_seconds}s')
+        return f'tracemalloc started, auto stop after {int(max_seconds)}s', True
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.started_at is None:
+                return 'tracemalloc is not started', False
+            tracemalloc.stop()
+            self.baseline = None
+            self.started_at = None
+        Logger.info('tracemalloc stopped')
+        return 'tracemalloc stopped', True
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def report(self, limit=20, key_type='lineno', reset_baseline=False):
+        """返回 (report, ok)，report 包含占用最多的分配位置 top 和相对基线增长最多的 diff"""
+        if key_type not in ('lineno', 'filename', 'traceback'):
+            return f'Unsupported group_by: {key_type}', False
+        with self._lock:
+            if self.started_at is None:
+                return 'tracemalloc is not started', False
+            snapshot = self._take_snapshot()
+            baseline = self.baseline
+            if reset_baseline:
+                self.baseline = snapshot
+            current, peak = tracemalloc.get_traced_memory()
+            started_at = self.started_at
+        top = [self._format_stat(stat) for stat in snapshot.statistics(key_type)[:limit]]
+        diff = [self._format_stat(stat) for stat in snapshot.compare_to(baseline, key_type)[:limit]]
+        return {
+            'tracing_seconds': round(time.time() - started_at, 1),
+            'traced_current': current,
+            'traced_peak': peak,
+            'tracemalloc_overhead': tracemalloc.get_tracemalloc_memory(),
+            'top': top,
+            'diff': diff,
+        }, True
+
+    @staticmethod
+    def _format_stat(stat):
+        data = {
+            'traceback': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback],
+            'size': stat.size,
+            'count': stat.count,
+        }
+        if isinstance(stat, tracemalloc.StatisticDiff):
+            data['size_diff'] = stat.size_diff
+            data['count_diff'] = stat.count_diff
+        return data
+
+
+tracemalloc_session = TracemallocSession()
+
+
+if __name__ == '__main__':
+    # 剖析自身: 一个忙循环线程应当占据绝大多数样本
+    def busy():
+        end = time.monotonic() + 1.5
+        while time.monotonic() < end:
+            sum(i * i for i in range(1000))
+
+    threading.Thread(target=busy, daemon=True).start()
+    text, ok = profile_cpu(1)
+    print(ok, sum(int(line.rsplit(' ', 1)[1]) for line in text.splitlines()), 'samples')
+    print(text.splitlines()[0][-200:])
+
+    print(tracemalloc_session.start(frames=5))
+    leak = [bytearray(1024) for _ in range(2000)]
+    report, ok = tracemalloc_session.report(limit=3)
+    print(ok, report['diff'][0])
+    print(tracemalloc_session.stop())
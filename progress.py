@@ -0,0 +1,148 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+from config import Config
+from log_tool import Logger
+from singleflight import FileLock
+
+
+class _Subscription(queue.Queue):
+    """订阅者的事件队列，dropped 记录因为客户端消费太慢而丢弃的 output 事件数"""
+
+    def __init__(self):
+        super().__init__()
+        self.dropped = 0
+
+
+class ProgressChannel:
+    """
+    一次长任务运行的进度事件流。
+
+    事件按顺序编号并保存在内存中，订阅者先收到 after_seq 之后的历史事件，再实时接收新事件；
+    命令输出只保留最近 max_history 条，步骤和结束事件单独保存不受限制，晚加入的订阅者总能看到完整的步骤列表；
+    每个订阅者只是一个队列，在 gevent 下等待事件的开销就是一个挂起的协程。
+    订阅者积压超过 max_pending 个事件时丢弃新的 output 事件，丢弃的行数合并到下一条送达的 output 事件的
+    dropped 字段中；步骤和结束事件数量很少，总是送达。
+    """
+
+    def __init__(self, max_history=2000, max_pending=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.max_history = max_history
+        self.max_pending = max_pending or Config.progress_max_pending
+        self.finished = False
+        self.result = None
+        self._seq = itertools.count(1)
+        self._events = []
+        self._output = deque(maxlen=max_history)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def publish(self, event, **data):
+        data['event'] = event
+        data['time'] = time.time()
+        with self._lock:
+            data['seq'] = next(self._seq)
+            (self._output if event == 'output' else self._events).append(data)
+            for subscriber in self._subscribers:
+                self._deliver(subscriber, data)
+
+    def _deliver(self, subscriber, data):
+        if data['event'] == 'output':
+            if subscriber.qsize() >= self.max_pending:
+                subscriber.dropped += 1
+                return
+            if subscriber.dropped:
+                data = dict(data, dropped=subscriber.dropped)
+                subscriber.dropped = 0
+        subscriber.put(data)
+
+    def subscribe(self, after_seq=0):
+        subscriber = _Subscription()
+        with self._lock:
+            for data in heapq.merge(self._events, self._output, key=lambda item: item['seq']):
+                if data['seq'] > after_seq:
+                    self._deliver(subscriber, data)
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def run_step(self, name, func, *args, **kwargs):
+        """
+        执行一个步骤并推送 step_start / step_finish 事件。
+        返回值沿用各工具函数自己的约定: (data, ok) 元组、bool，或者失败时返回 None。
+        """
+        self.publish('step_start', step=name)
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.publish('step_finish', step=name, ok=False, duration=round(time.time() - start, 3), msg=str(e))
+            raise
+        if isinstance(result, tuple):
+            ok = result[-1] is True
+        elif isinstance(result, bool):
+            ok = result
+        else:
+            ok = result is not None
+        self.publish('step_finish', step=name, ok=ok, duration=round(time.time() - start, 3))
+        return result
+
+    def finish(self, msg, ok):
+        self.result = (msg, ok)
+        self.finished = True
+        self.publish('done', ok=ok, msg=msg)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.result
+
+
+class ProgressRunner:
+    """
+    同一时刻只运行一个任务，运行期间重复启动会加入当前这次运行的进度流。
+    指定 lock_file 时任务运行期间持有该文件锁，其他进程中的同名任务要等这次运行结束才会开始。
+    """
+
+    def __init__(self, name, target, lock_file=None):
+        self.name = name
+        self.target = target
+        self.lock_file = lock_file
+        self.current = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.current is not None and not self.current.finished:
+                return self.current
+            channel = ProgressChannel()
+            self.current = channel
+        threading.Thread(target=self._run, args=(channel,), name=self.name, daemon=True).start()
+        return channel
+
+    def _run(self, channel):
+        file_lock = FileLock(self.lock_file) if self.lock_file else None
+        try:
+            if file_lock is not None and not file_lock.acquire(blocking=False):
+                channel.publish('waiting', msg=f'Another {self.name} is running, waiting for it to finish')
+                if not file_lock.acquire():
+                    raise RuntimeError(f'Failed to lock {self.lock_file}')
+            msg, ok = self.target(channel)
+        except Exception as e:
+            Logger.error('Failed to %s: %s', self.name, traceback.format_exc())
+            msg, ok = str(e), False
+        finally:
+            if file_lock is not None:
+                file_lock.release()
+        channel.finish(msg, ok)
@@ -1,14 +1,17 @@
+import gzip
+import hashlib
 import json
 import os
 import traceback
 import requests
 
+from circuit_breaker import CircuitBreaker
 from config import Config
 from log_tool import Logger
 
 
 class HttpClient:
-    def __init__(self):
+    def __init__(self, breaker_name='edge server'):
         host = os.environ.get('edgeServerHost')
         if host:
             self.host = host
@@ -17,43 +20,122 @@ class HttpClient:
         Logger.info(f'edge server host:{self.host}')
         self.timeout = Config.timeout
         self.success_code = 20000
+        self.cache_dir = Config.response_cache_dir
+        # 边缘服务端宕机时快速失败，不再让每个请求都等满 timeout
+        self.breaker = CircuitBreaker(breaker_name, Config.edge_breaker_failure_threshold,
+                                      Config.edge_breaker_reset_timeout, Config.edge_breaker_half_open_calls)
 
     def get(self, uri, headers=None, params=None):
         return self._run('get', self.host + uri, headers, params)
 
-    def post(self, uri, headers=None, data=None):
-        return self._run('post_json', self.host + uri, headers=headers, params=None, data=data)
+    def post(self, uri, headers=None, data=None, cache_key=None):
+        """
+        cache_key 不为空时启用本地磁盘缓存: 请求带上缓存内容的 ETag(服务端未提供时为内容哈希)作为 If-None-Match，
+        服务端返回 304 或者服务端不可达时直接使用缓存的响应。
+        """
+        if not cache_key:
+            return self._run('post_json', self.host + uri, headers=headers, params=None, data=data)
+        cache_path = self._cache_path(uri, cache_key)
+        cached = self._load_cache(cache_path)
+        if cached:
+            headers = dict(headers or {})
+            headers['If-None-Match'] = cached['etag']
+        return self._run('post_json', self.host + uri, headers=headers, params=None, data=data,
+                         cache_path=cache_path, cached=cached)
+
+    def post_gzip(self, uri, body, headers=None):
+        """body 为已经 gzip 压缩的 JSON 字节串，用于批量上报"""
+        headers = dict(headers or {})
+        headers.update({'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        return self._run('post_gzip', self.host + uri, headers=headers, params=None, data=body)
+
+    @staticmethod
+    def gzip_json(data):
+        return gzip.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
 
     def delete(self, uri, headers=None, data=None):
         return self._run('delete_json', self.host + uri, headers=headers, params=None, data=data)
 
-    def _run(self, method, url, headers=None, params=None, data=None):
+    def _cache_path(self, uri, cache_key):
+        name = hashlib.sha256(f'{uri}|{cache_key}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.json')
+
+    @staticmethod
+    def _load_cache(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_cache(cache_path, etag, result):
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'etag': etag, 'response': result}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            Logger.error(f'Failed to write response cache {cache_path}: {traceback.format_exc()}')
+
+    def _run(self, method, url, headers=None, params=None, data=None, cache_path=None, cached=None):
+        if method not in ('get', 'post_form', 'post_json', 'post_gzip', 'delete_json'):
+            return 'method not support', False
+        allowed, reason = self.breaker.allow()
+        if not allowed:
+            if cached:
+                Logger.info(f'Edge server circuit open, using cached response for {url}')
+                return cached['response'], True
+            return reason, False
         try:
             print(f'请求URL:{url}')
             print(f'请求头:{headers and json.dumps(headers)}')
             print(f'查询字符串:{params and json.dumps(params)}')
-            print(f'请求体:{data and json.dumps(data)}')
+            if isinstance(data, bytes):
+                Logger.info(f'Request body of {url}: <{len(data)} bytes>')
+            else:
+                print(f'请求体:{data and json.dumps(data)}')
             if method == 'get':
                 response = requests.get(url, params, headers=headers, timeout=self.timeout)
             elif method == 'post_form':
                 response = requests.post(url, data=data, headers=headers, timeout=self.timeout)
             elif method == 'post_json':
                 response = requests.post(url, json=data, headers=headers, timeout=self.timeout)
-            elif method == 'delete_json':
-                response = requests.delete(url, json=data, headers=headers, timeout=self.timeout)
+            elif method == 'post_gzip':
+                response = requests.post(url, data=data, headers=headers, timeout=self.timeout)
             else:
-                return 'method not support', False
+                response = requests.delete(url, json=data, headers=headers, timeout=self.timeout)
         except Exception as e:
             print(traceback.format_exc())
+            self.breaker.record_failure()
+            if cached:
+                Logger.info(f'Edge server unreachable, using cached response for {url}')
+                return cached['response'], True
             return '请求异常', False
         else:
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if response.status_code == 304 and cached:
+                Logger.info(f'Edge server returned 304 Not Modified, using cached response for {url}')
+                return cached['response'], True
             print(f'响应:{response.text}')
+            if response.status_code >= 500 and cached:
+                Logger.info(f'Edge server returned {response.status_code}, using cached response for {url}')
+                return cached['response'], True
             if response.status_code != 200:
                 return response.text, False
             result_data = response.json()
             if result_data['code'] == self.success_code:
+                if cache_path:
+                    etag = response.headers.get('ETag') or '"sha256-%s"' % hashlib.sha256(response.content).hexdigest()
+                    self._save_cache(cache_path, etag, result_data.get('response'))
                 return result_data.get('response'), True
             return result_data.get('message'), False
 
 
 http_client = HttpClient()
+# 遥测上报使用独立的熔断器，遥测接口自身的故障不会挡住注册、初始化等设备操作
+telemetry_client = HttpClient('edge telemetry')
@@ -0,0 +1,93 @@
+"""
+相同操作的并发调用合并(single-flight)。
+
+同一个 key 同一时刻只执行一次，执行期间到达的调用不再重复执行，而是等待并共享这次执行的结果或异常；
+执行结束后 key 立即释放，之后的调用会重新执行，不缓存结果。
+gevent patch 之后等待的调用方只是挂起的协程，不占用线程。
+"""
+import fcntl
+import os
+import threading
+
+from concurrency import offload
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.exception = None
+        self.traceback = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """执行 func(*args, **kwargs)，同一 key 正在执行时等待并返回那次执行的结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                # 多个调用方共享同一个异常对象，每次都从原始 traceback 抛出，避免 traceback 越叠越长
+                raise call.exception.with_traceback(call.traceback)
+            return call.value
+        try:
+            call.value = func(*args, **kwargs)
+        except BaseException as e:
+            call.exception = e
+            call.traceback = e.__traceback__
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+class FileLock:
+    """
+    跨进程的互斥锁，多个 gunicorn worker 之间串行执行不能并发的操作(例如设备初始化)。
+    加锁在原生线程中阻塞等待，不会卡住 gevent 事件循环。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        lock_dir = os.path.dirname(self.path)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        lock_file = open(self.path, 'w')
+        try:
+            if blocking:
+                offload(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            else:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,167 @@
+"""
+静态资源的预压缩与直出。
+
+构建时执行 `python static_assets.py static`:
+    - 为 css / js 等文本文件生成 .gz(以及安装了 brotli 时的 .br)压缩版本
+    - 生成 static/manifest.json，记录整个 static 目录的内容哈希和每个文件的哈希
+运行时 StaticAssetMiddleware 在 Flask 之前拦截 /assets/<目录哈希>/... 和 /static/... 请求，
+不经过 session、check_login 等钩子，直接以 wsgi.file_wrapper(gunicorn 下为 sendfile)返回文件:
+    - /assets/<目录哈希>/ 下的资源内容不会变化，返回一年的 immutable 缓存
+    - /static/ 下的资源每次带 ETag 重新验证，命中 If-None-Match 时返回 304
+    - 客户端支持时优先返回 br / gzip 预压缩版本
+模板中通过 asset_url('css/main.css') 生成带哈希的地址；css 中的相对路径在同一个哈希目录下依然有效。
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.security import safe_join
+from werkzeug.wsgi import FileWrapper
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.html', '.svg', '.json', '.txt')
+# 预压缩版本的后缀及对应的 Content-Encoding，按优先级排列
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+def _is_asset(name):
+    return name != MANIFEST_NAME and not name.endswith(tuple(suffix for _, suffix in ENCODINGS))
+
+
+def build_manifest(static_dir):
+    """计算每个文件的内容哈希以及整个目录的哈希"""
+    files = {}
+    for root, _, names in os.walk(static_dir):
+        for name in sorted(names):
+            if not _is_asset(name):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:16]
+            files[os.path.relpath(path, static_dir).replace(os.sep, '/')] = digest
+    tree_hash = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return {'tree_hash': tree_hash, 'files': files}
+
+
+def precompress(static_dir):
+    """为文本类资源生成压缩版本，压缩后没有明显变小的文件不生成"""
+    for root, _, names in os.walk(static_dir):
+        for name in names:
+            if not _is_asset(name) or not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(data, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) < len(data) * 0.9:
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+                elif os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+def load_manifest(static_dir):
+    """优先使用构建时生成的 manifest，开发环境下没有时现场计算"""
+    try:
+        with open(os.path.join(static_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return build_manifest(static_dir)
+
+
+class StaticAssetMiddleware:
+
+    def __init__(self, app, static_dir):
+        self.app = app
+        self.static_dir = static_dir
+        self.manifest = load_manifest(static_dir)
+        self.tree_hash = self.manifest['tree_hash']
+
+    def asset_url(self, path):
+        return f'/assets/{self.tree_hash}/{path}'
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith('/assets/'):
+            tree_hash, _, rel_path = path[len('/assets/'):].partition('/')
+            # 旧页面引用的哈希与当前版本不一致时仍返回当前文件，但不能让浏览器长期缓存
+            immutable = tree_hash == self.tree_hash
+        elif path.startswith('/static/'):
+            rel_path = path[len('/static/'):]
+            immutable = False
+        else:
+            return self.app(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self._respond(start_response, '405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+        digest = self.manifest['files'].get(rel_path)
+        file_path = safe_join(self.static_dir, rel_path) if digest else None
+        if not file_path or not os.path.isfile(file_path):
+            return self._respond(start_response, '404 Not Found')
+        return self._serve(environ, start_response, file_path, digest, immutable)
+
+    def _serve(self, environ, start_response, file_path, digest, immutable):
+        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        headers = [('Content-Type', content_type),
+                   ('Cache-Control', IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL)]
+        compressible = file_path.endswith(COMPRESSIBLE_EXTENSIONS)
+        if compressible:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        etag = digest
+        if compressible:
+            # 按 q 值选择客户端接受的预压缩版本(q=0 表示明确不接受)，q 值相同时按 ENCODINGS 的顺序
+            accept_encoding = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+            best_quality = 0
+            for encoding, suffix in ENCODINGS:
+                quality = accept_encoding[encoding]
+                if quality > best_quality and os.path.isfile(file_path + suffix):
+                    best_quality, best = quality, (encoding, suffix)
+            if best_quality:
+                encoding, suffix = best
+                file_path += suffix
+                etag = f'{digest}-{encoding}'
+                headers.append(('Content-Encoding', encoding))
+        headers.append(('ETag', f'"{etag}"'))
+
+        # If-None-Match 使用弱比较，支持 W/ 前缀、多个 ETag 以及 *
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and parse_etags(if_none_match).contains_weak(etag):
+            return self._respond(start_response, '304 Not Modified',
+                                 [header for header in headers if header[0] in ('Cache-Control', 'ETag', 'Vary')])
+
+        headers.append(('Content-Length', str(os.path.getsize(file_path))))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return file_wrapper(open(file_path, 'rb'), 64 * 1024)
+
+    @staticmethod
+    def _respond(start_response, status, headers=None):
+        start_response(status, (headers or []) + [('Content-Length', '0')])
+        return []
+
+
+if __name__ == '__main__':
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else 'static'
+    precompress(static_dir)
+    manifest = build_manifest(static_dir)
+    with open(os.path.join(static_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"static assets: {len(manifest['files'])} files, tree hash {manifest['tree_hash']}")
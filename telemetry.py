@@ -0,0 +1,150 @@
+"""
+设备心跳与主机指标的周期上报。
+
+每 Config.telemetry_interval 秒采样一次，攒够一批后以差分编码 + gzip 的形式 POST 到边缘服务端:
+    {"device_no", "auth", "interval", "fields": [...], "base": [第一条样本], "deltas": [[与上一条样本的差值], ...]}
+数值全部为整数(百分比乘以 10)，累计计数器的差值很小，压缩后每分钟只有几百字节。
+批大小根据上报耗时自适应: 链路慢时攒更多样本再发，链路快时缩小批次以降低延迟。
+边缘服务端不可达时批次写入本地 spool 目录，恢复后按时间顺序补发。
+"""
+import os
+import threading
+import time
+import traceback
+
+from config import Config
+from log_tool import Logger
+from proxy import telemetry_client
+from singleflight import FileLock
+from utils import sample_host_metrics
+
+FIELDS = ('time', 'cpu_percent', 'mem_percent', 'mem_used', 'disk_used', 'net_rx', 'net_tx')
+# 以 0.1% 为单位上报的字段
+PERCENT_FIELDS = ('cpu_percent', 'mem_percent')
+
+
+def encode_sample(metrics, timestamp):
+    row = [int(timestamp)]
+    for field in FIELDS[1:]:
+        value = metrics[field]
+        row.append(int(round(value * 10)) if field in PERCENT_FIELDS else int(value))
+    return row
+
+
+def encode_batch(samples):
+    """第一条样本原样保留，之后每条只记录与前一条的差值"""
+    deltas = []
+    for previous, current in zip(samples, samples[1:]):
+        deltas.append([c - p for p, c in zip(previous, current)])
+    return {'fields': list(FIELDS), 'base': samples[0], 'deltas': deltas}
+
+
+def is_telemetry_enabled():
+    """环境变量 telemetryEnabled 优先于 Config.telemetry_enabled"""
+    value = os.environ.get('telemetryEnabled')
+    if value is None:
+        return Config.telemetry_enabled
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def decode_batch(batch):
+    samples = [batch['base']]
+    for delta in batch['deltas']:
+        samples.append([p + d for p, d in zip(samples[-1], delta)])
+    return samples
+
+
+class TelemetryPusher:
+
+    def __init__(self, device_provider, client=None):
+        """device_provider 返回当前注册的设备信息(包含 device_no、auth)，设备未注册时返回 None"""
+        self.device_provider = device_provider
+        self.client = client or telemetry_client
+        self.interval = Config.telemetry_interval
+        self.batch_size = Config.telemetry_batch_size
+        self.spool_dir = Config.telemetry_spool_dir
+        self.samples = []
+        self.rtt = None
+        self._lock = FileLock(os.path.join(self.spool_dir, '.lock'))
+        self._started = False
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        多个 gunicorn worker 中只有拿到文件锁的那个负责上报。没有拿到锁的 worker 每个周期重试一次:
+        平滑重启(SIGHUP)时新 worker 先于旧 worker 启动，旧 worker 退出释放锁后由新 worker 接手。
+        """
+        if not is_telemetry_enabled() or self._started:
+            return False
+        self._started = True
+        threading.Thread(target=self._run, name='telemetry', daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._lock.held and not self._lock.acquire(blocking=False):
+                continue
+            try:
+                self.tick()
+            except Exception:
+                Logger.error(f'Failed to push telemetry: {traceback.format_exc()}')
+
+    def tick(self):
+        device = self.device_provider()
+        if not device:
+            self.samples.clear()
+            return
+        self.samples.append(encode_sample(sample_host_metrics(), time.time()))
+        if len(self.samples) < self.batch_size:
+            return
+        batch = encode_batch(self.samples)
+        self.samples = []
+        payload = {'device_no': device['device_no'], 'auth': device['auth'], 'interval': self.interval}
+        payload.update(batch)
+        body = self.client.gzip_json(payload)
+        if self._send(body):
+            self._drain_spool()
+        else:
+            self._spool(body)
+
+    def _send(self, body):
+        start = time.monotonic()
+        _, ok = self.client.post_gzip(Config.telemetry_url, body)
+        if ok:
+            self._adapt_batch_size(time.monotonic() - start)
+        return ok
+
+    def _adapt_batch_size(self, rtt):
+        self.rtt = rtt if self.rtt is None else 0.7 * self.rtt + 0.3 * rtt
+        if self.rtt > Config.telemetry_slow_rtt:
+            self.batch_size = min(self.batch_size * 2, Config.telemetry_max_batch_size)
+        elif self.rtt < Config.telemetry_slow_rtt / 4:
+            self.batch_size = max(self.batch_size // 2, Config.telemetry_batch_size)
+
+    def _spool_files(self):
+        if not os.path.isdir(self.spool_dir):
+            return []
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.json.gz'))
+
+    def _spool(self, body):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, '%d.json.gz' % time.time_ns())
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+        files = self._spool_files()
+        # 超出上限时丢弃最旧的批次
+        for name in files[:max(0, len(files) - Config.telemetry_spool_max_files)]:
+            os.remove(os.path.join(self.spool_dir, name))
+
+    def _drain_spool(self):
+        for name in self._spool_files()[:Config.telemetry_drain_batches]:
+            path = os.path.join(self.spool_dir, name)
+            with open(path, 'rb') as f:
+                body = f.read()
+            if not self._send(body):
+                return
+            os.remove(path)
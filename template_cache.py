@@ -0,0 +1,72 @@
+"""
+Jinja 模板的预编译字节码缓存与片段缓存。
+
+构建时执行 `python template_cache.py template_cache`，用应用自己的 jinja 环境把所有模板编译成字节码，
+PyInstaller 打包后新进程直接加载字节码，不再在第一次请求时解析、编译模板源码。
+缓存键只包含模板名，不包含文件的绝对路径，所以构建目录和运行时解压目录不同也能命中；
+模板源码变化时 jinja 会根据源码校验和自动重新编译。
+
+FragmentCache 按渲染数据的哈希缓存片段的渲染结果，模板中使用:
+    {{ fragment('fragments/network_interfaces.html', network_interfaces=network_interfaces) }}
+片段只能依赖显式传入的数据。
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from config import Config
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+
+    def get_cache_key(self, name, filename=None):
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+
+def precompile_templates(jinja_env):
+    for name in jinja_env.list_templates():
+        jinja_env.get_template(name)
+
+
+class FragmentCache:
+
+    def __init__(self, jinja_env, max_entries=None):
+        self.jinja_env = jinja_env
+        self.max_entries = max_entries or Config.fragment_cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def data_hash(context):
+        return hashlib.sha1(json.dumps(context, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def render(self, template_name, **context):
+        key = (template_name, self.data_hash(context))
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                return html
+        html = Markup(self.jinja_env.get_template(template_name).render(**context))
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return html
+
+
+if __name__ == '__main__':
+    cache_dir = sys.argv[1] if len(sys.argv) > 1 else 'template_cache'
+    os.makedirs(cache_dir, exist_ok=True)
+    # 使用应用自己的 jinja 环境(autoescape、扩展等配置相同)编译
+    from main import app
+
+    app.jinja_env.bytecode_cache = TemplateBytecodeCache(cache_dir)
+    precompile_templates(app.jinja_env)
+    print(f'templates precompiled into {cache_dir}: {len(app.jinja_env.list_templates())} templates')
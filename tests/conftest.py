@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# 模块都在仓库根目录下，按平铺方式导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# log_tool / db 在导入时按工作目录创建 logs/ 和数据库文件，测试在临时目录中运行，不污染仓库
+os.chdir(tempfile.mkdtemp(prefix='agent-tests-'))
@@ -0,0 +1,79 @@
+"""offload 把阻塞调用放到原生线程中执行，期间事件循环仍能处理其他请求"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# gevent patch 会影响整个进程，在子进程中启动一个 WSGI 服务端:
+# /slow 在请求协程中执行 1 秒的真实阻塞调用，/fast 立即返回；0.2 秒后请求 /fast，记录两个请求各自完成的时刻
+SCRIPT = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import json
+    import sys
+    import time
+    import urllib.request
+
+    import gevent
+    from gevent.pywsgi import WSGIServer
+
+    from concurrency import offload
+
+    blocking_sleep = monkey.get_original('time', 'sleep')
+    use_offload = sys.argv[1] == 'offload'
+
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            if use_offload:
+                offload(blocking_sleep, 1)
+            else:
+                blocking_sleep(1)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+
+    server = WSGIServer(('127.0.0.1', 0), app, log=None)
+    server.start()
+    url = f'http://127.0.0.1:{server.server_port}'
+
+
+    start = time.monotonic()
+
+
+    def finished_at(path):
+        urllib.request.urlopen(url + path, timeout=10).read()
+        return time.monotonic() - start
+
+
+    slow = gevent.spawn(finished_at, '/slow')
+    gevent.sleep(0.2)
+    fast = finished_at('/fast')
+    slow.join()
+    print(json.dumps({'fast': fast, 'slow': slow.value}))
+''')
+
+
+def run(mode):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-c', SCRIPT, mode], capture_output=True, text=True, timeout=60,
+                            env=env)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_offload_keeps_event_loop_responsive():
+    timings = run('offload')
+    assert timings['slow'] >= 1
+    # /fast 在 /slow 结束之前就完成了
+    assert timings['fast'] < 0.7
+
+
+def test_blocking_call_stalls_event_loop():
+    # 对照组: 不 offload 时 /fast 要等阻塞调用结束，说明上面的测试确实测到了事件循环是否被卡住
+    timings = run('inline')
+    assert timings['fast'] >= 1
@@ -0,0 +1,107 @@
+"""KubernetesSpec 直接生成字典，结果必须与 V1 模型序列化后的结果完全一致，并且明显更快"""
+import timeit
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from kubernetes.client import ApiClient
+
+import k8s_tool
+from k8s_tool import KubernetesObject, KubernetesSpec
+
+serializer = ApiClient()
+
+VOLUMES_INPUT = [
+    {"volume_type": 1, "mounted_source": "data-pvc", "container_path": "/data", "sub_path": "app"},
+    {"volume_type": 1, "mounted_source": "data-pvc", "container_path": "/logs", "sub_path": "logs"},
+    {"volume_type": 2, "mounted_source": "/var/run", "container_path": "/host/run", "name": "host-run"},
+    {"volume_type": 2, "mounted_source": "/etc/localtime", "container_path": "/etc/localtime"},
+    {"volume_type": 3, "mounted_source": "tls", "container_path": "/tls", "sub_path": ""},
+    {"volume_type": 4, "mounted_source": "app-config", "container_path": "/conf", "name": "conf"},
+    {"volume_type": 4, "mounted_source": "app-config", "container_path": "/conf2", "name": "conf"},
+    {"volume_type": 5, "mounted_source": "", "container_path": "/tmp"},
+]
+PROBE_INPUTS = [
+    {"http_get": {"path": "/healthz", "port": 8080, "scheme": "HTTP"}, "failure_threshold": 3,
+     "initial_delay_seconds": 10, "period_seconds": 5, "success_threshold": 1, "timeout_seconds": 2},
+    {"tcp_socket": {"port": 3306}, "failure_threshold": 3, "initial_delay_seconds": 0, "period_seconds": 10,
+     "success_threshold": 1, "timeout_seconds": 1},
+    {"_exec": {"command": "sh -c 'cat /tmp/ready'"}, "failure_threshold": 1, "initial_delay_seconds": None,
+     "period_seconds": 10, "success_threshold": 1, "timeout_seconds": 1},
+    {}, None,
+]
+RESOURCES_INPUTS = [{"limits": {"cpu": "1", "memory": "1Gi"}, "requests": {"cpu": "100m"}}, {"limits": {}}, None]
+
+CASES = [
+    (KubernetesObject.create_config_map_object, KubernetesSpec.config_map,
+     ("app", "default", {"a.conf": "x=1"}), {"labels": {"app": "demo"}}),
+    (KubernetesObject.create_config_map_object, KubernetesSpec.config_map, ("app", None, None), {}),
+    (KubernetesObject.create_secret_object, KubernetesSpec.secret, ("tls", "default", {"tls.crt": "YQ=="}), {}),
+]
+CASES += [(KubernetesObject.convert_dict_to_v1_probe, KubernetesSpec.probe, (data,), {}) for data in PROBE_INPUTS]
+CASES += [(KubernetesObject.convert_dict_to_resources, KubernetesSpec.resources, (data,), {})
+          for data in RESOURCES_INPUTS]
+CASES += [(KubernetesObject.convert_dict_to_volumes, KubernetesSpec.volumes, (data,), {})
+          for data in (VOLUMES_INPUT, [], None)]
+
+ERROR_CASES = [
+    (KubernetesObject.convert_dict_to_volumes, KubernetesSpec.volumes, ([{"volume_type": 9}],)),
+    (KubernetesObject.convert_dict_to_volumes, KubernetesSpec.volumes,
+     ([{"volume_type": 2, "mounted_source": None, "container_path": "/x"}],)),
+    (KubernetesObject.convert_dict_to_v1_probe, KubernetesSpec.probe,
+     ({"http_get": {"path": "/", "port": None, "scheme": "HTTP"}, "failure_threshold": 1},)),
+]
+
+
+@pytest.mark.parametrize("model_func, spec_func, args, kwargs", CASES)
+def test_spec_matches_models(model_func, spec_func, args, kwargs):
+    with mock.patch.object(k8s_tool, "datetime") as mock_datetime:
+        mock_datetime.now.return_value = datetime(2024, 1, 1)
+        expected = serializer.sanitize_for_serialization(model_func(*args, **kwargs))
+        actual = spec_func(*args, **kwargs)
+    if isinstance(expected, tuple):
+        expected, actual = list(expected), list(actual)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("model_func, spec_func, args", ERROR_CASES)
+def test_spec_raises_like_models(model_func, spec_func, args):
+    errors = []
+    for func in (model_func, spec_func):
+        with pytest.raises(Exception) as info:
+            func(*args)
+        errors.append(info.type)
+    assert errors[0] == errors[1]
+
+
+def test_spec_faster_than_models():
+    """一个工作负载的卷、探针、资源配置，重复生成"""
+
+    def build_with_models():
+        volume_mounts, volumes = KubernetesObject.convert_dict_to_volumes(VOLUMES_INPUT)
+        return serializer.sanitize_for_serialization({
+            "volumeMounts": volume_mounts,
+            "volumes": volumes,
+            "livenessProbe": KubernetesObject.convert_dict_to_v1_probe(PROBE_INPUTS[0]),
+            "readinessProbe": KubernetesObject.convert_dict_to_v1_probe(PROBE_INPUTS[1]),
+            "resources": KubernetesObject.convert_dict_to_resources(RESOURCES_INPUTS[0]),
+        })
+
+    def build_with_spec():
+        volume_mounts, volumes = KubernetesSpec.volumes(VOLUMES_INPUT)
+        return {
+            "volumeMounts": volume_mounts,
+            "volumes": volumes,
+            "livenessProbe": KubernetesSpec.probe(PROBE_INPUTS[0]),
+            "readinessProbe": KubernetesSpec.probe(PROBE_INPUTS[1]),
+            "resources": KubernetesSpec.resources(RESOURCES_INPUTS[0]),
+        }
+
+    assert build_with_spec() == build_with_models()
+    number = 500
+    model_time = min(timeit.repeat(build_with_models, number=number, repeat=3))
+    spec_time = min(timeit.repeat(build_with_spec, number=number, repeat=3))
+    print(f"V1 models + serialize: {model_time / number * 1e6:.1f} us/spec, "
+          f"KubernetesSpec: {spec_time / number * 1e6:.1f} us/spec, speedup {model_time / spec_time:.1f}x")
+    # 实测约 40 倍，留足余量避免在繁忙的机器上误报
+    assert spec_time * 5 < model_time
@@ -0,0 +1,122 @@
+"""ProcMetrics 的解析结果与 psutil 一致，并且单次采样比 psutil 更快、分配更少"""
+import os
+import time
+import tracemalloc
+
+import psutil
+import pytest
+
+from proc_metrics import ProcMetrics
+
+STAT = (b"cpu  100 5 50 1000 20 3 2 7 4 0\n"
+        b"cpu0 100 5 50 1000 20 3 2 7 4 0\n"
+        b"intr 1 2 3\n")
+MEMINFO = (b"MemTotal:        1000000 kB\n"
+           b"MemFree:          200000 kB\n"
+           b"MemAvailable:     600000 kB\n"
+           b"Buffers:           50000 kB\n"
+           b"Cached:           250000 kB\n"
+           b"SwapCached:        99999 kB\n"
+           b"SReclaimable:      30000 kB\n")
+NET_DEV = (b"Inter-|   Receive                                                |  Transmit\n"
+           b" face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls "
+           b"carrier compressed\n"
+           b"    lo: 1234       10    0    0    0     0          0         0     1234      10    0    0    0     0 "
+           b"      0          0\n"
+           b"  eth0:98765432 12345    0    0    0     0          0         0 12345678    2345    0    0    0     0 "
+           b"      0          0\n")
+
+
+@pytest.fixture
+def fake_proc(tmp_path):
+    (tmp_path / 'net').mkdir()
+    (tmp_path / 'stat').write_bytes(STAT)
+    (tmp_path / 'meminfo').write_bytes(MEMINFO)
+    (tmp_path / 'net' / 'dev').write_bytes(NET_DEV)
+    metrics = ProcMetrics(str(tmp_path))
+    yield metrics
+    metrics.close()
+
+
+def test_cpu_times(fake_proc):
+    # guest / guest_nice 已经计入 user，只累加前 8 个字段
+    assert fake_proc.cpu_times() == (100 + 5 + 50 + 1000 + 20 + 3 + 2 + 7, 1000 + 20)
+
+
+def test_memory(fake_proc):
+    assert fake_proc.memory() == {
+        'total': 1000000 * 1024,
+        'available': 600000 * 1024,
+        'used': (1000000 - 200000 - 50000 - 250000 - 30000) * 1024,
+        'free': 200000 * 1024,
+        'percent': 40.0,
+    }
+
+
+def test_net_io(fake_proc):
+    assert fake_proc.net_io() == {'lo': (1234, 1234), 'eth0': (98765432, 12345678)}
+
+
+def test_buffer_grows(tmp_path):
+    (tmp_path / 'net').mkdir()
+    (tmp_path / 'stat').write_bytes(STAT)
+    (tmp_path / 'meminfo').write_bytes(MEMINFO)
+    lines = [NET_DEV]
+    for i in range(200):
+        lines.append(f"veth{i:04d}: {i} 0 0 0 0 0 0 0 {i * 2} 0 0 0 0 0 0 0\n".encode())
+    (tmp_path / 'net' / 'dev').write_bytes(b''.join(lines))
+    metrics = ProcMetrics(str(tmp_path))
+    try:
+        result = metrics.net_io()
+    finally:
+        metrics.close()
+    assert len(result) == 202
+    assert result['veth0199'] == (199, 398)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/net/dev'), reason='requires Linux /proc')
+def test_matches_psutil():
+    metrics = ProcMetrics()
+    try:
+        assert metrics.memory()['total'] == psutil.virtual_memory().total
+        assert set(metrics.net_io()) == set(psutil.net_io_counters(pernic=True))
+        total, idle = metrics.cpu_times()
+        assert 0 < idle <= total
+    finally:
+        metrics.close()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/net/dev'), reason='requires Linux /proc')
+def test_benchmark_against_psutil():
+    metrics = ProcMetrics()
+
+    def sample_psutil():
+        psutil.cpu_times()
+        psutil.virtual_memory()
+        psutil.net_io_counters(pernic=True)
+
+    def sample_proc():
+        metrics.cpu_times()
+        metrics.memory()
+        metrics.net_io()
+
+    number = 1000
+    results = {}
+    try:
+        for name, sample in (('psutil', sample_psutil), ('proc', sample_proc)):
+            sample()
+            start = time.perf_counter()
+            for _ in range(number):
+                sample()
+            elapsed = time.perf_counter() - start
+            # 单次采样过程中分配内存的峰值
+            tracemalloc.start()
+            sample()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = (elapsed / number, peak)
+            print(f'{name:7s} {elapsed / number * 1e6:8.1f} us/sample, peak {peak} bytes allocated/sample')
+    finally:
+        metrics.close()
+    assert results['proc'][0] < results['psutil'][0]
+    assert results['proc'][1] < results['psutil'][1]
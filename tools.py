@@ -1,18 +1,26 @@
 import base64
+import hashlib
 import json
 import os
 import platform
 import shlex
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import uuid
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
+import yaml
+
+from config import Config
+from db import get_db_connection, close_db_connection
 from log_tool import Logger
 
 
@@ -30,23 +38,156 @@ def get_namespace(ns):
         Logger.error(f"Error querying namespaces: {e}")
         return False
 
-def run_command(command, input_text=None, check=True):
-    """Execute a shell command and return its output."""
+# 命令输出订阅者，回调签名为 callback(command, stream, line)，用于把命令输出逐行推送到进度流等。
+# 订阅只对当前线程(gevent 下为当前协程)中执行的 run_command 生效，并发执行的其他命令不会混入。
+_output_context = threading.local()
+
+
+def _current_subscribers():
+    subscribers = getattr(_output_context, 'subscribers', None)
+    if subscribers is None:
+        subscribers = _output_context.subscribers = []
+    return subscribers
+
+
+def subscribe_output(callback):
+    _current_subscribers().append(callback)
+
+
+def unsubscribe_output(callback):
+    subscribers = _current_subscribers()
+    if callback in subscribers:
+        subscribers.remove(callback)
+
+
+def _publish_output(subscribers, command, stream, line):
+    for callback in subscribers:
+        try:
+            callback(command, stream, line.rstrip('\n'))
+        except Exception:
+            Logger.error(traceback.format_exc())
+
+
+class _OutputTail:
+    """只保留最近 max_chars 个字符的输出，超长的单行也会被 readline 切分成多段"""
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.size = 0
+        self.chunks = deque()
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.max_chars and len(self.chunks) > 1:
+            self.size -= len(self.chunks.popleft())
+
+    def text(self):
+        # 读取线程可能仍在追加(被逃逸的孙进程占着管道)，先取快照
+        return ''.join(list(self.chunks))
+
+
+def _pump_output(subscribers, command, stream, pipe, tail):
+    try:
+        for count, line in enumerate(iter(lambda: pipe.readline(Config.command_max_line), ''), 1):
+            tail.append(line)
+            _publish_output(subscribers, command, stream, line)
+            if count % Config.command_yield_lines == 0:
+                # patch 之后 sleep(0) 让出事件循环，大量输出时其他请求不会被饿死
+                time.sleep(0)
+    finally:
+        pipe.close()
+
+
+def _feed_input(pipe, input_text):
+    try:
+        pipe.write(input_text)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def _kill_process_group(process):
+    """
+    命令通过 shell 启动并带有子进程(例如 curl | sh)，需要对整个进程组发信号。
+    返回进程的退出码；SIGKILL 之后仍未退出(例如卡在不可中断的 IO 中)时返回 None，不再继续等待。
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            break
+        try:
+            return process.wait(timeout=Config.command_kill_grace)
+        except subprocess.TimeoutExpired:
+            continue
+    return process.poll()
+
+
+def _join_workers(workers, timeout):
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        worker.join(max(deadline - time.monotonic(), 0))
+    return [worker for worker in workers if worker.is_alive()]
+
+
+def run_command(command, input_text=None, check=True, timeout=None):
+    """
+    Execute a shell command and return its output.
+
+    stdout / stderr are read line by line and forwarded to output subscribers while the command runs;
+    only the last Config.command_output_tail characters of each are kept and returned.
+    The command runs in its own process group and the whole group is killed once timeout expires.
+    """
+    timeout = Config.command_timeout if timeout is None else timeout
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        text=True,
+        errors='replace',
+        stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    stdout_tail = _OutputTail(Config.command_output_tail)
+    stderr_tail = _OutputTail(Config.command_output_tail)
+    # 读取输出的线程中拿不到调用方的订阅，这里先取出来传进去
+    subscribers = list(_current_subscribers())
+    workers = [
+        threading.Thread(target=_pump_output, args=(subscribers, command, 'stdout', process.stdout, stdout_tail),
+                         daemon=True),
+        threading.Thread(target=_pump_output, args=(subscribers, command, 'stderr', process.stderr, stderr_tail),
+                         daemon=True),
+    ]
+    if input_text is not None:
+        workers.append(threading.Thread(target=_feed_input, args=(process.stdin, input_text), daemon=True))
+    for worker in workers:
+        worker.start()
+    timed_out = False
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=check,
-            text=True,
-            input=input_text,
-            capture_output=True
-        )
-        return result.stdout, result.stderr, result.returncode
-    except subprocess.CalledProcessError as e:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        returncode = _kill_process_group(process)
+    # 命令已经退出，但留在后台的孙进程继承了管道时读取线程不会结束，等待一段时间后不再等待，
+    # 读取线程在孙进程退出、管道关闭后自行退出并关闭管道
+    if _join_workers(workers, Config.command_kill_grace):
+        Logger.error(f"Output pipes of command are still held by background processes, stop reading: {command}")
+    stdout, stderr = stdout_tail.text(), stderr_tail.text()
+    if timed_out:
+        stderr += f"\nCommand timed out after {timeout}s and was killed"
+    if returncode is None:
+        stderr += "\nCommand did not exit after SIGKILL"
+        returncode = -signal.SIGKILL
+    if returncode != 0 and (check or timed_out):
         Logger.error(f"Error executing command: {command}")
-        Logger.error(f"Error message: {e.stderr}")
-        Logger.error(traceback.format_exc())
-        return e.stdout, e.stderr, e.returncode
+        Logger.error(f"Error message: {stderr}")
+    return stdout, stderr, returncode
 
 
 def check_k3s_installed():
@@ -121,9 +262,64 @@ def create_configmap_tz():
         return False
 
 
-def apply_kubernetes_yaml(K8S_YAML):
-    """Apply the provided Kubernetes YAML configuration using kubectl."""
+def _manifest_object_key(obj):
+    metadata = obj.get("metadata") or {}
+    return "{}/{}/{}/{}".format(obj.get("apiVersion", ""), obj.get("kind", ""),
+                                metadata.get("namespace", ""), metadata.get("name", ""))
+
+
+def _manifest_hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def _load_manifest_ledger(ledger_key):
+    try:
+        cursor = get_db_connection().cursor()
+        cursor.execute("SELECT set_hash FROM applied_manifest WHERE ledger_key = ?", (ledger_key,))
+        row = cursor.fetchone()
+        cursor.execute("SELECT object_key, object_hash FROM applied_object WHERE ledger_key = ?", (ledger_key,))
+        return (row[0] if row else None), dict(cursor.fetchall())
+    finally:
+        close_db_connection()
+
+
+def _save_manifest_ledger(ledger_key, set_hash, object_hashes):
+    try:
+        conn = get_db_connection()
+        conn.execute("INSERT OR REPLACE INTO applied_manifest (ledger_key, set_hash, applied_time) VALUES (?, ?, ?)",
+                     (ledger_key, set_hash, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.execute("DELETE FROM applied_object WHERE ledger_key = ?", (ledger_key,))
+        conn.executemany("INSERT INTO applied_object (ledger_key, object_key, object_hash) VALUES (?, ?, ?)",
+                         [(ledger_key, key, value) for key, value in object_hashes.items()])
+        conn.commit()
+    finally:
+        close_db_connection()
+
+
+def _count_existing_objects(objects):
+    """一次 kubectl get 确认账本中记录的对象仍然存在，返回找到的数量"""
+    stdout, stderr, returncode = run_command("kubectl get -f - -o name --ignore-not-found",
+                                             input_text=yaml.safe_dump_all(objects), check=False)
+    if returncode != 0:
+        return -1
+    return len([line for line in stdout.splitlines() if line.strip()])
+
+
+def apply_kubernetes_yaml(K8S_YAML, ledger_key=None):
+    """
+    Apply the provided Kubernetes YAML configuration using kubectl.
+
+    With ledger_key, every object's normalized hash is recorded after a successful apply; on the next call objects
+    whose desired state is unchanged (and that still exist in the cluster) are skipped and only changed ones are applied.
+    """
     Logger.info("Applying Kubernetes YAML configuration...")
+    if ledger_key:
+        try:
+            objects = [obj for obj in yaml.safe_load_all(K8S_YAML) if obj]
+        except yaml.YAMLError as e:
+            Logger.error(f"Failed to parse Kubernetes YAML, applying without ledger: {e}")
+        else:
+            return _apply_with_ledger(ledger_key, objects)
     # Create a temporary file to store the YAML
     # with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as temp_file:
     #     temp_file.write(K8S_YAML)
@@ -152,6 +348,36 @@ def apply_kubernetes_yaml(K8S_YAML):
         return False
 
 
+def _apply_with_ledger(ledger_key, objects):
+    object_hashes = {_manifest_object_key(obj): _manifest_hash(obj) for obj in objects}
+    set_hash = hashlib.sha256(json.dumps(sorted(object_hashes.items())).encode()).hexdigest()
+    last_set_hash, last_object_hashes = _load_manifest_ledger(ledger_key)
+    changed, unchanged = [], []
+    for obj in objects:
+        key = _manifest_object_key(obj)
+        if last_set_hash == set_hash or last_object_hashes.get(key) == object_hashes[key]:
+            unchanged.append(obj)
+        else:
+            changed.append(obj)
+    # 被手动删除的对象需要重新创建，数量对不上时把未变化的对象也一起 apply
+    if unchanged and _count_existing_objects(unchanged) != len(unchanged):
+        Logger.info(f"Some recorded objects of {ledger_key} are missing from the cluster, re-applying all.")
+        changed, unchanged = objects, []
+    for obj in unchanged:
+        _publish_output("kubectl apply", "stdout", f"{_manifest_object_key(obj)} unchanged (skipped)")
+    Logger.info(f"{ledger_key}: {len(changed)} objects to apply, {len(unchanged)} unchanged objects skipped.")
+    if changed:
+        stdout, stderr, returncode = run_command("kubectl apply -f -", input_text=yaml.safe_dump_all(changed))
+        if returncode != 0:
+            Logger.error(f"Failed to apply Kubernetes YAML: {stderr}")
+            return False
+        Logger.info("Kubernetes YAML applied successfully:")
+        Logger.info(stdout)
+    if last_set_hash != set_hash:
+        _save_manifest_ledger(ledger_key, set_hash, object_hashes)
+    return True
+
+
 def check_kubectl():
     """Check kubectl functionality by listing nodes."""
     Logger.info("Checking kubectl functionality...")
@@ -236,7 +462,7 @@ def init_k3s():
             return "kubectl check failed", False
     else:
         Logger.error("k3s is still not running. Exiting.")
-        return False, "k3s is not running"
+        return "k3s is not running", False
     return "k3s is running and kubectl is functional", True
 
 
@@ -365,6 +591,108 @@ def install_helm():
         return False
 
 
+_file_digest_cache = {}
+
+
+def _file_digest(path):
+    """chart 包的 sha256，按 (路径, 大小, 修改时间) 缓存，同一进程内重复初始化不再重新读取文件"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _file_digest_cache.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        _file_digest_cache[key] = digest
+    return digest
+
+
+def _values_hash(values):
+    """values 按 YAML 语义归一化后再哈希，注释、缩进和键顺序的变化不会导致重新部署"""
+    if not values:
+        return hashlib.sha256(b'').hexdigest()
+    try:
+        normalized = json.dumps(yaml.safe_load(values), sort_keys=True, separators=(',', ':'), default=str)
+    except yaml.YAMLError:
+        normalized = values
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _get_helm_release(release_name, namespace):
+    """返回 (release, ok)，release 为 helm list 的条目，不存在时为 None"""
+    filter_cmd = f"helm list --namespace {namespace} --filter {release_name} -o json"
+    stdout, stderr, returncode = run_command(filter_cmd, check=False)
+    if returncode != 0:
+        Logger.error(f"Error checking Helm release: {stderr}")
+        return None, False
+    releases = json.loads(stdout) if stdout else []
+    for release in releases:
+        if release["name"] == release_name:
+            return release, True
+    return None, True
+
+
+def _load_helm_release_record(release_name, namespace):
+    try:
+        cursor = get_db_connection().cursor()
+        cursor.execute("SELECT chart_digest, values_hash, revision FROM helm_release "
+                       "WHERE namespace = ? AND release_name = ?", (namespace, release_name))
+        return cursor.fetchone()
+    finally:
+        close_db_connection()
+
+
+def _save_helm_release_record(release_name, namespace, chart_digest, values_hash, revision):
+    try:
+        conn = get_db_connection()
+        conn.execute("INSERT OR REPLACE INTO helm_release (namespace, release_name, chart_digest, values_hash, "
+                     "revision, deployed_time) VALUES (?, ?, ?, ?, ?, ?)",
+                     (namespace, release_name, chart_digest, values_hash, revision,
+                      datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    finally:
+        close_db_connection()
+
+
+def helm_install_or_upgrade(release_name, namespace, chart_file, values=None):
+    """
+    安装或升级 Helm release。
+
+    chart 包摘要和 values 哈希与上次成功部署记录一致、且 release 处于 deployed 状态并且 revision 未被他人改动时，
+    直接跳过 upgrade，避免重新渲染整套 manifests。
+    """
+    release, ok = _get_helm_release(release_name, namespace)
+    if not ok:
+        return False
+    chart_digest = _file_digest(chart_file)
+    values_hash = _values_hash(values)
+    if release and release.get("status") == "deployed":
+        record = _load_helm_release_record(release_name, namespace)
+        if record == (chart_digest, values_hash, int(release.get("revision", 0))):
+            Logger.info(f"Helm release {release_name} is up to date (chart and values unchanged). Skipping upgrade.")
+            return True
+    if release:
+        cmd = f"helm upgrade {release_name} {chart_file} -n {namespace}"
+    else:
+        cmd = f"helm install {release_name} {chart_file} -n {namespace}"
+    if values:
+        cmd += " -f -"
+        stdout, stderr, returncode = run_command(cmd, input_text=values, timeout=Config.helm_timeout)
+    else:
+        stdout, stderr, returncode = run_command(cmd, timeout=Config.helm_timeout)
+    if returncode != 0:
+        if "already exists" in stderr:
+            return True
+        Logger.error(f"Failed to install {release_name}: {stderr}")
+        return False
+    release, ok = _get_helm_release(release_name, namespace)
+    if ok and release:
+        _save_helm_release_record(release_name, namespace, chart_digest, values_hash, int(release.get("revision", 0)))
+    return True
+
+
 def install_prometheus(prometheus_script):
     try:
         release_name = "kps"
@@ -383,26 +711,7 @@ def install_prometheus(prometheus_script):
         if not prometheus_helm_file or not os.path.exists(prometheus_helm_file):
             Logger.info(f"Helm package for {prometheus_helm_file} not found at {package}")
             return False
-        filter_cmd = f"helm list --namespace monitoring --filter {release_name} -o json"
-        stdout, stderr, returncode = run_command(filter_cmd, check=False)
-        if returncode != 0:
-            Logger.info(f"Error checking Helm release: {stderr}")
-            return False
-        releases = json.loads(stdout) if stdout else []
-        release_exists = any(release["name"] == release_name for release in releases)
-        if release_exists:
-            cmd = f"helm upgrade {release_name} {prometheus_helm_file} -n monitoring"
-        else:
-            cmd = f"helm install {release_name} {prometheus_helm_file} -n monitoring"
-        if prometheus_script:
-            cmd += " -f -"
-            stdout, stderr, returncode = run_command(cmd, input_text=prometheus_script)
-        else:
-            stdout, stderr, returncode = run_command(cmd)
-        if returncode != 0 and "already exists" not in stderr:
-            Logger.info(f"Failed to install prometheus: {stderr}")
-            return False
-        return True
+        return helm_install_or_upgrade(release_name, namespace, prometheus_helm_file, prometheus_script)
     except Exception as e:
         Logger.info(f"Error installing prometheus: {e}")
         return False
@@ -423,22 +732,7 @@ def install_telegraf(config):
         if not telegraf_helm_file or not os.path.exists(telegraf_helm_file):
             Logger.error(f"Helm package for {telegraf_helm_file} not found at {package}")
             return False
-        filter_cmd = f"helm list --namespace {namespace} --filter {release_name} -o json"
-        stdout, stderr, returncode = run_command(filter_cmd, check=False)
-        if returncode != 0:
-            Logger.error(f"Error checking Helm release: {stderr}")
-            return False
-        releases = json.loads(stdout) if stdout else []
-        release_exists = any(release["name"] == release_name for release in releases)
-        if release_exists:
-            cmd = f"helm upgrade {release_name} {telegraf_helm_file} -n {namespace} -f -"
-        else:
-            cmd = f"helm install {release_name} {telegraf_helm_file} -n {namespace} -f -"
-        stdout, stderr, returncode = run_command(cmd, input_text=config)
-        if returncode != 0 and "already exists" not in stderr:
-            Logger.error(f"Failed to install prometheus: {stderr}")
-            return False
-        return True
+        return helm_install_or_upgrade(release_name, namespace, telegraf_helm_file, config)
 
     except Exception as e:
         Logger.error(traceback.format_exc())
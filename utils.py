@@ -3,12 +3,23 @@ import json
 import re
 import socket
 import subprocess
+import threading
+import time
 
 import psutil
-import netifaces
 import os
 import platform
 
+from concurrency import NativeCall, offload
+from config import Config
+from interface_tracker import interface_tracker, is_excluded
+from log_tool import Logger
+from proc_metrics import ProcMetrics
+from singleflight import SingleFlight
+
+# 并发请求共用一次阻塞的 CPU 采样
+_cpu_flight = SingleFlight()
+
 
 def get_hostname():
     """获取本机主机名"""
@@ -43,38 +54,90 @@ def get_local_ip():
 
 
 def get_network_interfaces_details():
-    """获取所有网络接口的详细信息"""
-    interfaces = {}
-    for interface in netifaces.interfaces():
-        if interface.startswith('lo') or interface.startswith('docker') or interface.startswith('veth') or \
-                interface.startswith('flannel') or interface.startswith('cni'):
-            continue
-        try:
-            addrs = netifaces.ifaddresses(interface)
-            interfaces[interface] = {}
-            if netifaces.AF_INET in addrs:  # IPv4
-                interfaces[interface]['ipv4'] = [
-                    {'addr': addr['addr'], 'netmask': addr.get('netmask'), 'broadcast': addr.get('broadcast')}
-                    for addr in addrs[netifaces.AF_INET]
-                ]
-            if netifaces.AF_INET6 in addrs:  # IPv6
-                interfaces[interface]['ipv6'] = [
-                    {'addr': addr['addr'], 'netmask': addr.get('netmask')}
-                    for addr in addrs[netifaces.AF_INET6]
-                ]
-        except Exception as e:
-            print(f"Error processing interface {interface}: {e}")
-            continue
-    return interfaces
+    """获取所有网络接口的详细信息，由 interface_tracker 根据 rtnetlink 事件增量维护"""
+    return interface_tracker.get_interfaces()
+
+
+_proc_metrics = None
+
+
+def get_metrics_backend():
+    """指标采集后端: psutil 或 proc，环境变量 metricsBackend 优先于 Config.metrics_backend"""
+    return os.environ.get('metricsBackend') or Config.metrics_backend
+
+
+def _get_proc_metrics():
+    global _proc_metrics
+    if _proc_metrics is None:
+        _proc_metrics = ProcMetrics()
+    return _proc_metrics
+
+
+class CpuSampler:
+    """
+    按两次采样的 CPU 时间差计算使用率(%)，不阻塞等待。
+    psutil.cpu_percent(interval=None) 全进程只有一个基线，多个使用方会互相重置采样区间；
+    每个使用方(页面、/api/device_info、遥测)各自持有一个 CpuSampler。
+    第一次调用还没有基线，先等待 Config.cpu_sample_interval 秒采一个短区间。
+    """
+
+    def __init__(self):
+        self._last = None
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _times():
+        """返回 (总时间, 空闲时间)"""
+        if get_metrics_backend() == 'proc':
+            return _get_proc_metrics().cpu_times()
+        times = psutil.cpu_times()
+        # guest 已经计入 user，不重复累加
+        total = sum(times) - getattr(times, 'guest', 0) - getattr(times, 'guest_nice', 0)
+        return total, times.idle + getattr(times, 'iowait', 0)
+
+    def percent(self):
+        with self._lock:
+            if self._last is None:
+                self._last = self._times()
+                time.sleep(Config.cpu_sample_interval)
+            total, idle = self._times()
+            last_total, last_idle = self._last
+            delta = total - last_total
+            # 两次调用间隔太短时沿用上一次的值
+            if delta > 0:
+                self._value = round(max(0.0, min(100.0, (delta - (idle - last_idle)) / delta * 100)), 1)
+                self._last = (total, idle)
+            return self._value
+
+
+_page_cpu_sampler = CpuSampler()
+_api_cpu_sampler = CpuSampler()
+_telemetry_cpu_sampler = CpuSampler()
+
+
+def cpu_percent():
+    """CPU 使用率(%)，proc 后端按两次采样的差值计算，不需要等待"""
+    if get_metrics_backend() == 'proc':
+        return _page_cpu_sampler.percent()
+    return _cpu_flight.do('cpu_percent', psutil.cpu_percent, interval=1)
+
+
+def virtual_memory():
+    """返回 {'total', 'used', 'available', 'percent'}，单位字节"""
+    if get_metrics_backend() == 'proc':
+        return _get_proc_metrics().memory()
+    memory = psutil.virtual_memory()
+    return {'total': memory.total, 'used': memory.used, 'available': memory.available, 'percent': memory.percent}
 
 
 def get_cpu_info():
     """获取 CPU 使用率"""
-    cpu_percent = psutil.cpu_percent(interval=1)
+    cpu_percent_value = cpu_percent()
     logical_cores = psutil.cpu_count(logical=True)
     physical_cores = psutil.cpu_count(logical=False)
     return {
-        "cpu_percent": f"{cpu_percent}%",
+        "cpu_percent": f"{cpu_percent_value}%",
         "logical_cores": logical_cores,
         "physical_cores": physical_cores
     }
@@ -82,40 +145,93 @@ def get_cpu_info():
 
 def get_memory_info():
     """获取内存信息"""
-    memory = psutil.virtual_memory()
+    memory = virtual_memory()
     return {
-        "mem_total": f"{memory.total / (1024 ** 3):.2f} GB",
-        "mem_used": f"{memory.used / (1024 ** 3):.2f} GB",
-        "mem_available": f"{memory.available / (1024 ** 3):.2f} GB",
-        "mem_percent": f"{memory.percent}%"
+        "mem_total": f"{memory['total'] / (1024 ** 3):.2f} GB",
+        "mem_used": f"{memory['used'] / (1024 ** 3):.2f} GB",
+        "mem_available": f"{memory['available'] / (1024 ** 3):.2f} GB",
+        "mem_percent": f"{memory['percent']}%"
     }
 
 
+_disk_lock = threading.Lock()
+# 挂载点 -> (隔离截止时间, 隔离时长)
+_disk_quarantine = {}
+# 超时后仍未返回的 statvfs 调用，返回之前不会对同一挂载点再发起新的调用
+_disk_pending = {}
+_disk_usage_cache = {'time': 0, 'result': None}
+
+
+def _is_ignored_mountpoint(mountpoint):
+    # 过滤 Kubernetes 临时挂载点
+    return 'snap' in mountpoint or '/var/lib/kubelet/pods' in mountpoint
+
+
+def get_disk_usages():
+    """
+    并发获取所有分区的使用情况，返回 [(partition, usage)]，无法获取时 usage 为 None。
+
+    每个挂载点的 statvfs 在原生线程中执行，整体最多等待 Config.disk_stat_timeout 秒；
+    超时的挂载点(失效的 NFS / iSCSI 等)会被隔离一段时间，期间直接视为不可用。结果缓存 Config.disk_stat_cache_ttl 秒。
+    """
+    with _disk_lock:
+        now = time.monotonic()
+        if _disk_usage_cache['result'] is not None and now - _disk_usage_cache['time'] < Config.disk_stat_cache_ttl:
+            return _disk_usage_cache['result']
+        partitions = [p for p in offload(psutil.disk_partitions) if not _is_ignored_mountpoint(p.mountpoint)]
+        calls = {}
+        for partition in partitions:
+            mountpoint = partition.mountpoint
+            if mountpoint in calls or _disk_quarantine.get(mountpoint, (0, 0))[0] > now:
+                continue
+            pending = _disk_pending.get(mountpoint)
+            if pending is not None:
+                if not pending.ready():
+                    continue
+                del _disk_pending[mountpoint]
+            calls[mountpoint] = NativeCall(psutil.disk_usage, mountpoint)
+
+        deadline = now + Config.disk_stat_timeout
+        usages = {}
+        for mountpoint, call in calls.items():
+            try:
+                usages[mountpoint] = call.get(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                _, period = _disk_quarantine.get(mountpoint, (0, 0))
+                period = min(period * 2, Config.disk_stat_quarantine * 8) if period else Config.disk_stat_quarantine
+                _disk_quarantine[mountpoint] = (time.monotonic() + period, period)
+                _disk_pending[mountpoint] = call
+                Logger.error(f'statvfs on {mountpoint} timed out, quarantined for {period}s')
+            except Exception:
+                pass
+            else:
+                _disk_quarantine.pop(mountpoint, None)
+
+        result = [(partition, usages.get(partition.mountpoint)) for partition in partitions]
+        _disk_usage_cache['time'] = time.monotonic()
+        _disk_usage_cache['result'] = result
+        return result
+
+
 def get_disk_info():
     """获取磁盘总容量和每个分区的详细信息"""
     try:
         total_capacity = 0
         total_used = 0
         disk_info = {}
-        partitions = psutil.disk_partitions()
-        for partition in partitions:
-            # 过滤 Kubernetes 临时挂载点
-            mountpoint = partition.mountpoint
-            if 'snap' in mountpoint or '/var/lib/kubelet/pods' in mountpoint:
-                continue
-            try:
-                disk = psutil.disk_usage(mountpoint)
-                total_capacity += disk.total
-                total_used += disk.used
-                disk_info[mountpoint] = {
-                    "total": f"{disk.total / (1024 ** 3):.2f} GB",
-                    "used": f"{disk.used / (1024 ** 3):.2f} GB",
-                    "free": f"{disk.free / (1024 ** 3):.2f} GB",
-                    "percent": f"{disk.percent}%",
-                    "device": partition.device,
-                }
-            except:
+        for partition, disk in get_disk_usages():
+            if disk is None:
                 disk_info[partition.mountpoint] = "无法获取详细信息"
+                continue
+            total_capacity += disk.total
+            total_used += disk.used
+            disk_info[partition.mountpoint] = {
+                "total": f"{disk.total / (1024 ** 3):.2f} GB",
+                "used": f"{disk.used / (1024 ** 3):.2f} GB",
+                "free": f"{disk.free / (1024 ** 3):.2f} GB",
+                "percent": f"{disk.percent}%",
+                "device": partition.device,
+            }
         total_usage_percent =f"{(total_used / total_capacity) * 100 if total_capacity > 0 else 0:.2f}%"
 
         return {
@@ -129,21 +245,116 @@ def get_disk_info():
         return 0, f"获取磁盘信息失败: {str(e)}"
 
 
+def sample_host_metrics():
+    """
+    采集一次用于遥测上报的主机指标，全部为数值: CPU / 内存使用率(%)、内存与磁盘已用字节数、网卡累计收发字节数。
+    CPU 使用率是距离上一次采样期间的值，不会阻塞等待。
+    """
+    cpu = _telemetry_cpu_sampler.percent()
+    if get_metrics_backend() == 'proc':
+        net_io = _get_proc_metrics().net_io()
+    else:
+        net_io = {name: (counters.bytes_recv, counters.bytes_sent)
+                  for name, counters in psutil.net_io_counters(pernic=True).items()}
+    memory = virtual_memory()
+    disk_used = 0
+    for partition, disk in get_disk_usages():
+        if disk is not None:
+            disk_used += disk.used
+    net_rx = net_tx = 0
+    for name, (rx, tx) in net_io.items():
+        if not is_excluded(name):
+            net_rx += rx
+            net_tx += tx
+    return {
+        'cpu_percent': cpu,
+        'mem_percent': memory['percent'],
+        'mem_used': memory['used'],
+        'disk_used': disk_used,
+        'net_rx': net_rx,
+        'net_tx': net_tx,
+    }
+
+
+def _device_cpu():
+    return {
+        'percent': _api_cpu_sampler.percent(),
+        'logical_cores': psutil.cpu_count(logical=True),
+        'physical_cores': psutil.cpu_count(logical=False),
+    }
+
+
+def _device_disk():
+    total = used = 0
+    partitions = []
+    for partition, disk in get_disk_usages():
+        if disk is None:
+            partitions.append({'mountpoint': partition.mountpoint, 'device': partition.device, 'available': False})
+            continue
+        total += disk.total
+        used += disk.used
+        partitions.append({
+            'mountpoint': partition.mountpoint,
+            'device': partition.device,
+            'available': True,
+            'total': disk.total,
+            'used': disk.used,
+            'free': disk.free,
+            'percent': disk.percent,
+        })
+    return {'total': total, 'used': used, 'percent': round(used / total * 100, 2) if total else 0,
+            'partitions': partitions}
+
+
+# /api/device_info 支持的字段及其采集函数，全部返回数值(字节、百分比)
+DEVICE_INFO_FIELDS = {
+    'hostname': get_hostname,
+    'os': get_os_info,
+    'cpu': _device_cpu,
+    'mem': virtual_memory,
+    'disk': _device_disk,
+    'interfaces': get_network_interfaces_details,
+}
+
+
+# 每次采样都会变化的使用量，不参与 ETag 计算，否则轮询方几乎拿不到 304
+DEVICE_INFO_VOLATILE = {
+    'cpu': {'percent'},
+    'mem': {'used', 'available', 'free', 'percent'},
+    'disk': {'used', 'free', 'percent'},
+}
+
+
+def get_device_info(fields=None):
+    """只采集 fields 中列出的字段，fields 为空时采集全部"""
+    return {field: DEVICE_INFO_FIELDS[field]() for field in (fields or DEVICE_INFO_FIELDS)}
+
+
+def _drop_keys(value, keys):
+    if isinstance(value, dict):
+        return {key: _drop_keys(item, keys) for key, item in value.items() if key not in keys}
+    if isinstance(value, list):
+        return [_drop_keys(item, keys) for item in value]
+    return value
+
+
+def stable_device_info(info):
+    """去掉 DEVICE_INFO_VOLATILE 中的使用量(包括磁盘分区中的同名字段)，用于计算 ETag"""
+    return {field: _drop_keys(value, DEVICE_INFO_VOLATILE.get(field, ())) for field, value in info.items()}
+
+
 def get_cpu_mem_disk():
     physical_cores = psutil.cpu_count(logical=False)
 
-    memory = psutil.virtual_memory()
-    mem_total = f"{memory.total / (1024 ** 3):.2f} GB"
+    mem_total = f"{virtual_memory()['total'] / (1024 ** 3):.2f} GB"
 
     total_capacity = 0
-    partitions = psutil.disk_partitions()
-    for partition in partitions:
-        # 过滤 Kubernetes 临时挂载点
-        mountpoint = partition.mountpoint
-        if 'snap' in mountpoint or '/var/lib/kubelet/pods' in mountpoint:
-            continue
-        disk = psutil.disk_usage(mountpoint)
-        total_capacity += disk.total
+    try:
+        for partition, disk in get_disk_usages():
+            if disk is not None:
+                total_capacity += disk.total
+    except Exception as e:
+        Logger.error(f'Failed to get disk usage: {e}')
     total_capacity = f"{total_capacity / (1024 ** 3):.2f} GB"
     return physical_cores, mem_total, total_capacity
 
@@ -1,15 +1,43 @@
+# 必须在导入任何其他模块之前完成 monkey patch，否则 socket / ssl / subprocess 仍是阻塞实现
+from gevent import monkey
+
+monkey.patch_all()
+
+import runpy
 import sys
 
-from gevent import pywsgi
+from gunicorn.app.base import BaseApplication
 
 from main import app
+from tools import get_resource_path
+
+
+class AgentApplication(BaseApplication):
+    """内嵌的 gunicorn，使 PyInstaller 打包后的 nodeAgent 与 gunicorn 命令行使用同一份 gunicorn.conf.py"""
+
+    def __init__(self, application, port=None):
+        self.application = application
+        self.port = port
+        super().__init__()
+
+    def load_config(self):
+        config = runpy.run_path(get_resource_path('gunicorn.conf.py'))
+        for key, value in config.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+        if self.port:
+            self.cfg.set('bind', '0.0.0.0:%s' % self.port)
+
+    def load(self):
+        return self.application
+
 
 if __name__ == '__main__':
-    port = sys.argv[1] if len(sys.argv) > 1 else 5000
-    try:
-        port = int(port)
-    except Exception as e:
-        sys.exit('Invalid port number: %s' % port)
-    print('Starting server on port %s...' % port)
-    server = pywsgi.WSGIServer(('0.0.0.0', port), app)
-    server.serve_forever()
\ No newline at end of file
+    port = sys.argv[1] if len(sys.argv) > 1 else None
+    if port is not None:
+        try:
+            port = int(port)
+        except Exception as e:
+            sys.exit('Invalid port number: %s' % port)
+    print('Starting server on port %s...' % (port or 'from gunicorn.conf.py'))
+    AgentApplication(app, port).run()